@@ -0,0 +1,63 @@
+# encoding:utf-8
+"""
+聊天记录归档
+
+较早的聊天记录从数据库移到按会话、按天划分的 gzip 压缩 JSONL 文件中，文件索引保存在数据库的
+archive_segments 表里，总结时按需读取。同一天的记录可以多次追加到同一个文件(多个 gzip 成员)。
+"""
+import gzip
+import hashlib
+import json
+import os
+
+from common.log import logger
+
+
+class SegmentArchive:
+    def __init__(self, root: str):
+        """
+        :param root: 归档文件的根目录
+        """
+        self.root = root
+
+    @staticmethod
+    def segment_path(session_id: str, day: str) -> str:
+        """归档文件相对于根目录的路径，会话id可能包含特殊字符，目录名使用其哈希"""
+        digest = hashlib.sha1(session_id.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(digest, f"{day}.jsonl.gz")
+
+    def append(self, path: str, rows):
+        """追加记录并落盘
+
+        :param rows: 每条为(msgid, user, content, type, timestamp, is_triggered)
+        """
+        full_path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        data = "".join(json.dumps({"msgid": msgid, "user": user, "content": content, "type": msg_type,
+                                   "timestamp": timestamp, "is_triggered": is_triggered}, ensure_ascii=False) + "\n"
+                       for msgid, user, content, msg_type, timestamp, is_triggered in rows)
+        with open(full_path, "ab") as f:
+            f.write(gzip.compress(data.encode("utf-8")))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read(self, path: str) -> list:
+        """读取归档文件中的全部记录，按时间升序；重复归档的记录只保留一条"""
+        full_path = os.path.join(self.root, path)
+        try:
+            with gzip.open(full_path, "rt", encoding="utf-8") as f:
+                rows = {}
+                for line in f:
+                    row = json.loads(line)
+                    rows[row["msgid"]] = row
+        except FileNotFoundError:
+            logger.warning("[Summary] archive segment not found: %s", full_path)
+            return []
+        return sorted(rows.values(), key=lambda row: row["timestamp"])
+
+    def remove(self, path: str):
+        full_path = os.path.join(self.root, path)
+        try:
+            os.remove(full_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,405 @@
+# encoding:utf-8
+"""
+性能基准测试
+
+生成模拟的群聊记录(多个会话，昵称和消息长度接近真实分布)，依次测量消息写入、各种条件的记录查询、
+完整的总结流程、归档以及过期清理，结果输出为JSON，便于比较不同版本。大模型和图片生成使用桩实现，
+不产生任何网络请求。数据库和归档文件写在临时目录中，不影响插件的数据。
+
+在 chatgpt-on-wechat 根目录下运行：
+
+    python -m plugins.plugin_summary.benchmark --sessions 20 --records 1000000 --output result.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from common.log import logger
+from plugins.plugin_summary import chunking
+from plugins.plugin_summary.db import Db
+
+# 昵称的组成部分
+_NICK_PREFIXES = ["小", "老", "阿", "大", "", "", "", "Mr.", "the_"]
+_NICK_CHARS = "明华强伟芳娜静丽军磊洋勇艳杰涛超秀霞平刚桂英鹏飞宇浩然子轩雨萱梓涵一诺欣怡"
+_NICK_WORDS = ["Tom", "Lucy", "Kevin", "Amy", "Jack", "cat", "momo", "Leo", "阳光", "咸鱼", "奶茶", "打工人"]
+_NICK_SUFFIXES = ["", "", "", "🌸", "🐱", "_", "2023", "～", "(请备注)", "🍀"]
+# 消息内容使用的常用字
+_COMMON_CHARS = ("的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产"
+                 "种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业"
+                 "本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气"
+                 "第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处队南给色光门即保治北造百规热领七海口东导器压志世金增争济阶油思术极交受联什认六共权收证改清己美再采转更单风切打白教速花带安场身车例真务具万每目至达走积示议声报斗完类八离华名确才科张信马节话米整空元况今集温传土许步群广石记需段研界拉林律叫且究观越织装影算低持音众书布复容儿须际商非验连断深难近矿千周委素技备半办青省列习响约支般史感劳便团往酸历市克何除消构府称太准精值号率族维划选标写存候毛亲快效斯院查江型眼王按格养易置派层片始却专状育厂京识适属圆包火住调满县局照参红细引听该铁价严")
+_PUNCTUATION = "，。！？～、"
+_REACTIONS = ["哈哈哈哈", "哈哈哈哈哈哈", "+1", "[捂脸]", "[强]", "666", "确实", "。。。", "？？？", "好的", "收到", "😂😂😂",
+              "[旺柴]", "笑死", "真的假的", "牛"]
+_KEYWORD = "世界杯"
+_SHORT_KEYWORD = "周末"
+
+
+class StubSession:
+    def __init__(self, session_id, system_prompt):
+        self.session_id = session_id
+        self.system_prompt = system_prompt
+        self.messages = []
+
+    def add_query(self, query):
+        self.messages.append(query)
+
+
+class StubSessions:
+    def build_session(self, session_id, system_prompt=None):
+        return StubSession(session_id, system_prompt)
+
+    def clear_session(self, session_id):
+        pass
+
+
+class StubBot:
+    """固定延迟的大模型，按输入长度估算token数"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.sessions = StubSessions()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self._lock = threading.Lock()
+
+    def reply_text(self, session):
+        prompt_tokens = chunking.estimate_tokens((session.system_prompt or "") + "".join(session.messages))
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+        time.sleep(self.latency)
+        content = "\n".join(f"{index}️⃣ 话题{index}：讨论了一些内容 🔥热度：{index * 10}" for index in range(1, 6))
+        completion_tokens = chunking.estimate_tokens(content)
+        return {"content": content, "total_tokens": prompt_tokens + completion_tokens,
+                "completion_tokens": completion_tokens}
+
+
+class StubRenderer:
+    """固定延迟的图片生成，返回与文本长度相关的假图片内容"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def convert_text_to_image(self, text) -> bytes:
+        time.sleep(self.latency)
+        return b"\x89PNG\r\n\x1a\n" + text.encode("utf-8")
+
+
+class CorpusGenerator:
+    """可复现的模拟群聊记录：会话大小和成员发言频率为长尾分布，白天消息多、夜间少"""
+
+    def __init__(self, sessions: int, users: int, days: int, seed: int, end_time: int = None):
+        """
+        :param end_time: 最后一条消息的时间上限，默认为今天零点，保证相同参数生成相同的数据
+        """
+        self.random = random.Random(seed)
+        today = time.localtime()
+        self.end_time = end_time or int(time.mktime((today.tm_year, today.tm_mon, today.tm_mday, 0, 0, 0, 0, 0, -1)))
+        self.start_time = self.end_time - days * 86400
+        self.days = days
+        self.session_ids = [f"bench-group-{index}" for index in range(sessions)]
+        # 少数大群占了大部分消息
+        self.session_weights = [1 / (rank + 1) ** 0.8 for rank in range(sessions)]
+        self.members = {}
+        for session_id in self.session_ids:
+            # 成员数的中位数约为users
+            count = max(2, int(self.random.paretovariate(1.2) * users / 1.8))
+            names = list(dict.fromkeys(self._nickname() for _ in range(min(count, users * 4))))
+            self.members[session_id] = (names, [1 / (rank + 1) ** 1.1 for rank in range(len(names))])
+        # 各小时的消息量：凌晨最少，晚上最多
+        self.hour_weights = [1, 0.5, 0.3, 0.2, 0.2, 0.3, 1, 2, 4, 6, 7, 7, 8, 6, 6, 7, 7, 6, 6, 8, 10, 10, 7, 3]
+
+    def _nickname(self) -> str:
+        r = self.random
+        if r.random() < 0.3:
+            body = r.choice(_NICK_WORDS)
+        else:
+            body = "".join(r.choice(_NICK_CHARS) for _ in range(r.randint(1, 3)))
+        return r.choice(_NICK_PREFIXES) + body + r.choice(_NICK_SUFFIXES)
+
+    def _content(self) -> str:
+        r = self.random
+        kind = r.random()
+        if kind < 0.15:
+            return r.choice(_REACTIONS)
+        if kind < 0.18:
+            # 链接、代码等长文本
+            return "https://example.com/" + "".join(r.choice("abcdefghijklmnopqrstuvwxyz0123456789/")
+                                                    for _ in range(r.randint(200, 1500)))
+        # 消息长度近似对数正态分布，中位数约15字
+        length = min(max(int(r.lognormvariate(math.log(15), 0.8)), 1), 800)
+        chars = [r.choice(_PUNCTUATION) if r.random() < 0.08 else r.choice(_COMMON_CHARS) for _ in range(length)]
+        text = "".join(chars)
+        if kind > 0.99:
+            text = text[:length // 2] + _KEYWORD + text[length // 2:]
+        elif kind > 0.97:
+            text = _SHORT_KEYWORD + text
+        return text
+
+    def _timestamps(self, count: int) -> list:
+        r = self.random
+        hours = r.choices(range(24), weights=self.hour_weights, k=count)
+        timestamps = []
+        for hour in hours:
+            day = r.randrange(self.days)
+            timestamps.append(self.start_time + day * 86400 + hour * 3600 + r.randrange(3600))
+        timestamps.sort()
+        return timestamps
+
+    def records(self, count: int):
+        """按时间顺序生成记录，每条为(session_id, msg_id, user, content, timestamp)"""
+        r = self.random
+        sessions = r.choices(self.session_ids, weights=self.session_weights, k=count)
+        for index, (session_id, timestamp) in enumerate(zip(sessions, self._timestamps(count))):
+            names, weights = self.members[session_id]
+            user = r.choices(names, weights=weights)[0]
+            yield session_id, f"bench-{index}", user, self._content(), timestamp
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def _timed(func, repeat: int) -> dict:
+    """多次执行func，返回最小和中位耗时以及最后一次的结果"""
+    durations = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        durations.append(time.perf_counter() - started)
+    return {"min_seconds": round(min(durations), 6), "median_seconds": round(_percentile(durations, 0.5), 6),
+            "result": result}
+
+
+def bench_ingest(db: Db, corpus: CorpusGenerator, count: int) -> dict:
+    """写入消息：insert_record 的调用耗时即消息处理线程被占用的时间"""
+    latencies = []
+    started = time.perf_counter()
+    for session_id, msg_id, user, content, timestamp in corpus.records(count):
+        call_started = time.perf_counter()
+        db.insert_record(session_id, msg_id, user, content, "TEXT", timestamp, 0)
+        latencies.append(time.perf_counter() - call_started)
+    db.flush()
+    elapsed = time.perf_counter() - started
+    return {"records": count, "seconds": round(elapsed, 3), "records_per_second": round(count / elapsed),
+            "insert_p50_us": round(_percentile(latencies, 0.5) * 1e6, 1),
+            "insert_p99_us": round(_percentile(latencies, 0.99) * 1e6, 1),
+            "insert_max_us": round(max(latencies) * 1e6, 1),
+            "db_size_bytes": _db_size(db)}
+
+
+def _db_size(db: Db) -> int:
+    return sum(os.path.getsize(db.db_path + suffix) for suffix in ("", "-wal") if os.path.exists(db.db_path + suffix))
+
+
+def _session_profile(db: Db, session_id: str) -> dict:
+    """会话的记录数和发言最多的成员，用于构造查询条件"""
+    with db._reader() as conn:
+        count = conn.execute("SELECT COUNT(*) FROM chat_records WHERE sessionid=?", (session_id,)).fetchone()[0]
+        top_user = conn.execute("SELECT u.name FROM chat_records r JOIN users u ON u.id = r.user_id "
+                                "WHERE r.sessionid=? GROUP BY u.name ORDER BY COUNT(*) DESC LIMIT 1",
+                                (session_id,)).fetchone()
+    return {"records": count, "top_user": top_user[0] if top_user else None}
+
+
+def _query_shapes(corpus: CorpusGenerator, top_user: str) -> dict:
+    """与总结指令对应的各种查询条件"""
+    end = corpus.end_time
+    shapes = {
+        "all": {},
+        "last_3_hours": {"start_timestamp": end - 3 * 3600},
+        "last_day": {"start_timestamp": end - 86400},
+        "limit_100": {"limit": 100},
+        "limit_1000_last_day": {"start_timestamp": end - 86400, "limit": 1000},
+        "keyword": {"keyword": _KEYWORD},
+        "keyword_last_day": {"keyword": _KEYWORD, "start_timestamp": end - 86400},
+        "short_keyword": {"keyword": _SHORT_KEYWORD},
+    }
+    if top_user:
+        shapes["user"] = {"username": [top_user]}
+        shapes["user_prefix"] = {"username": [top_user[:2]]}
+        shapes["keyword_user"] = {"keyword": _KEYWORD, "username": [top_user]}
+    return shapes
+
+
+def bench_queries(db: Db, corpus: CorpusGenerator, session_ids: list, repeat: int) -> dict:
+    """各种条件读取全部匹配的记录"""
+    results = {}
+    for session_id in session_ids:
+        profile = _session_profile(db, session_id)
+        shapes = {}
+        for name, kwargs in _query_shapes(corpus, profile["top_user"]).items():
+            timed = _timed(lambda: sum(1 for _ in db.iter_records(session_id, **kwargs)), repeat)
+            timed["rows"] = timed.pop("result")
+            shapes[name] = timed
+        results[session_id] = {"records": profile["records"], "shapes": shapes}
+    return results
+
+
+def _create_plugin(db: Db, bot: StubBot, renderer, config: dict):
+    """创建不注册事件、不启动定时任务的插件实例，数据库、大模型和图片生成替换为基准测试的实现"""
+    from plugins.plugin_summary.main import Summary
+
+    plugin = Summary.__new__(Summary)
+    plugin.config = config
+    plugin._init_components()
+    plugin._components.update(db=db, bot=bot)
+    if renderer is not None:
+        plugin._components["renderer"] = renderer
+    return plugin
+
+
+def bench_summaries(plugin, bot: StubBot, corpus: CorpusGenerator, session_ids: list) -> dict:
+    """完整的总结流程：读取、预处理、分段请求大模型、合并、生成图片；第二次相同的总结命中缓存"""
+    end = corpus.end_time
+    scenarios = {
+        "last_day": {"start_time": end - 86400},
+        "last_day_cached": {"start_time": end - 86400},
+        "limit_200": {"start_time": corpus.start_time, "limit": 200},
+        "keyword": {"start_time": corpus.start_time, "keyword": _KEYWORD},
+        "all": {"start_time": corpus.start_time},
+    }
+    results = {}
+    for session_id in session_ids:
+        session_results = {}
+        for name, kwargs in scenarios.items():
+            calls, prompt_tokens = bot.calls, bot.prompt_tokens
+            started = time.perf_counter()
+            reply = plugin._generate_summary(session_id, **kwargs)
+            session_results[name] = {"seconds": round(time.perf_counter() - started, 4),
+                                     "llm_calls": bot.calls - calls,
+                                     "prompt_tokens": bot.prompt_tokens - prompt_tokens,
+                                     "reply_type": str(reply.type)}
+        results[session_id] = session_results
+    return results
+
+
+def bench_archive(db: Db, corpus: CorpusGenerator, session_id: str, repeat: int) -> dict:
+    """归档最早四分之一的记录，再读取跨越归档的全部记录"""
+    before = corpus.start_time + corpus.days * 86400 // 4
+    started = time.perf_counter()
+    archived = db.archive_records(before)
+    elapsed = time.perf_counter() - started
+    timed = _timed(lambda: sum(1 for _ in db.iter_records(session_id)), repeat)
+    timed["rows"] = timed.pop("result")
+    return {"archived": archived, "seconds": round(elapsed, 3), "read_all_with_archive": timed}
+
+
+def bench_cleanup(db: Db, corpus: CorpusGenerator, batch_size: int) -> dict:
+    """清理前一半时间的记录，同时另一个线程持续写入消息，记录写入被阻塞的时间"""
+    latencies = []
+    stop = threading.Event()
+
+    def write():
+        index = 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            db.insert_record("bench-cleanup-writer", f"bench-cleanup-{index}", "writer", "cleanup", "TEXT",
+                             corpus.end_time, 0)
+            db.flush()
+            latencies.append(time.perf_counter() - started)
+            index += 1
+            time.sleep(0.001)
+
+    writer = threading.Thread(target=write, daemon=True)
+    size_before = _db_size(db)
+    writer.start()
+    stats = db.purge_records(corpus.start_time + corpus.days * 86400 // 2, batch_size=batch_size)
+    stop.set()
+    writer.join()
+    return {"stats": stats, "db_size_before": size_before, "db_size_after": _db_size(db),
+            "concurrent_writes": len(latencies),
+            "write_p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+            "write_max_ms": round(max(latencies, default=0) * 1000, 2)}
+
+
+def _load_config(overrides: dict) -> dict:
+    with open(os.path.join(os.path.dirname(__file__), "config.json.template"), "r", encoding="utf-8") as f:
+        config = json.load(f)
+    config.update(overrides)
+    return config
+
+
+def run(args) -> dict:
+    work_dir = args.dir or tempfile.mkdtemp(prefix="summary-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+    config = _load_config({"summary_cache_persist": False, "render_fallback": False,
+                           "llm_concurrency": args.llm_concurrency, **json.loads(args.config)})
+    db = Db(batch_size=config.get("write_batch_size", 100), flush_interval=config.get("write_flush_interval", 500),
+            read_pool_size=config.get("read_pool_size", 2), archive_dir=os.path.join(work_dir, "archive"),
+            db_path=os.path.join(work_dir, "bench.db"))
+    corpus = CorpusGenerator(args.sessions, args.users, args.days, args.seed)
+    bot = StubBot(args.llm_latency)
+    renderer = StubRenderer(args.render_latency) if args.render == "stub" else None
+    results = {}
+    try:
+        logger.info("[Summary] benchmark: ingesting %d records into %s", args.records, work_dir)
+        results["ingest"] = bench_ingest(db, corpus, args.records)
+        # 最大的会话和中等大小的会话
+        session_ids = [corpus.session_ids[0], corpus.session_ids[len(corpus.session_ids) // 2]]
+        session_ids = list(dict.fromkeys(session_ids))
+        logger.info("[Summary] benchmark: queries")
+        results["query"] = bench_queries(db, corpus, session_ids, args.repeat)
+        logger.info("[Summary] benchmark: summaries")
+        plugin = _create_plugin(db, bot, renderer, config)
+        results["summary"] = bench_summaries(plugin, bot, corpus, session_ids)
+        if not args.skip_archive:
+            logger.info("[Summary] benchmark: archive")
+            results["archive"] = bench_archive(db, corpus, session_ids[0], args.repeat)
+        logger.info("[Summary] benchmark: cleanup")
+        results["cleanup"] = bench_cleanup(db, corpus, config.get("clean_batch_size", 2000))
+    finally:
+        db.close()
+        if not args.dir and not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "params": vars(args),
+        "environment": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                        "platform": platform.platform(), "fts": db.fts_enabled},
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="聊天记录总结插件的性能基准测试")
+    parser.add_argument("--records", type=int, default=100000, help="生成的消息总数")
+    parser.add_argument("--sessions", type=int, default=20, help="会话数量")
+    parser.add_argument("--users", type=int, default=50, help="会话的平均成员数")
+    parser.add_argument("--days", type=int, default=7, help="消息跨越的天数，截止到今天零点")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子，相同参数生成相同的数据")
+    parser.add_argument("--repeat", type=int, default=3, help="每个查询的重复次数")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="桩大模型每次请求的延迟(秒)")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="同时请求大模型的上限")
+    parser.add_argument("--render", choices=("stub", "local"), default="stub", help="图片生成：桩实现或本地渲染")
+    parser.add_argument("--render-latency", type=float, default=0.0, help="桩图片生成的延迟(秒)")
+    parser.add_argument("--config", default="{}", help="覆盖插件配置的JSON，例如 '{\"chunk_max_tokens\": 4000}'")
+    parser.add_argument("--skip-archive", action="store_true", help="不测试归档")
+    parser.add_argument("--dir", help="数据目录，默认使用临时目录并在结束后删除")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录")
+    parser.add_argument("--output", help="结果JSON文件，默认输出到标准输出")
+    args = parser.parse_args(argv)
+
+    result = json.dumps(run(args), ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(result)
+    else:
+        sys.stdout.write(result + "\n")
+
+
+if __name__ == "__main__":
+    main()
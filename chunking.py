@@ -0,0 +1,39 @@
+# encoding:utf-8
+"""
+聊天记录分段
+
+聊天记录过多时按token预算切分为若干段，每段分别总结后再合并。
+"""
+import math
+import re
+
+_CJK_RE = re.compile(r"[⺀-鿿가-힯豈-﫿＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中日韩字符按每字1个token，其他字符按每4个字符1个token"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def split_chunks(lines, max_tokens: int) -> list:
+    """按时间顺序将聊天记录切分为若干段，每段不超过max_tokens
+
+    Args:
+        lines: 按时间升序排列的聊天记录文本
+        max_tokens: 每段的token上限，单条超过上限的记录单独成段
+
+    Returns:
+        list[list[str]]: 分段后的聊天记录
+    """
+    chunks, chunk, chunk_tokens = [], [], 0
+    for line in lines:
+        tokens = estimate_tokens(line) + 1
+        if chunk and chunk_tokens + tokens > max_tokens:
+            chunks.append(chunk)
+            chunk, chunk_tokens = [], 0
+        chunk.append(line)
+        chunk_tokens += tokens
+    if chunk:
+        chunks.append(chunk)
+    return chunks
@@ -0,0 +1,136 @@
+# encoding:utf-8
+"""
+总结指令的本地解析
+
+常见的 "$总结 999"、"$总结 3小时内的前99条消息"、"$总结 三十分钟" 等格式直接在本地解析，
+只有本地无法确定含义的指令才需要交给大模型翻译。
+"""
+import datetime
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+_CN_DIGITS = {'零': 0, '〇': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4,
+              '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+_CN_UNITS = {'十': 10, '百': 100, '千': 1000}
+# 中文数字，也包含与中文单位混用的阿拉伯数字，例如 "3千"、"1.5万"
+_CN_NUMBER_RE = re.compile(r"(?:\d+(?:\.\d+)?)?[零〇一二两三四五六七八九十百千万][\d零〇一二两三四五六七八九十百千万]*")
+_CN_TOKEN_RE = re.compile(r"\d+(?:\.\d+)?|.")
+
+# 时间单位(秒)
+_DURATION_UNITS = {
+    '秒': 1, '秒钟': 1,
+    '分': 60, '分钟': 60,
+    '小时': 3600, '钟头': 3600,
+    '天': 86400, '日': 86400,
+    '周': 604800, '星期': 604800, '礼拜': 604800,
+}
+_UNIT_PATTERN = "|".join(sorted(_DURATION_UNITS, key=len, reverse=True))
+_HALF_RE = re.compile(r"(\d+)?个?半(?=个?(?:{}))".format(_UNIT_PATTERN))
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)个?({})".format(_UNIT_PATTERN))
+_TODAY_RE = re.compile(r"今天|今日")
+_COUNT_RES = (re.compile(r"(\d+)(?:条|句)"), re.compile(r"(?:前|最近|最后)(\d+)"))
+_BARE_NUMBER_RE = re.compile(r"^(\d+)$")
+_KEYWORD_RE = re.compile(r"(?:关键词|关键字)\s*[:：]\s*(\S+)")
+# 不影响含义的词，解析完成后剩余内容只能由这些词组成
+_FILLER_RE = re.compile(r"以内|之内|内|的|最近|过去|最后|前|条|句|消息|信息|聊天记录|记录|聊天|群聊|内容|"
+                        r"总结|帮我|帮忙|请|所有|全部|一下|下|吧|呗|[，,。.！!？?、~]")
+
+
+def cn_to_int(text: str) -> int:
+    """中文数字转整数，例如 "九十九" -> 99，"两万三千" -> 23000；阿拉伯数字按一个数位处理，"3千" -> 3000"""
+    total, section, number = 0, 0, 0
+    for token in _CN_TOKEN_RE.findall(text):
+        if token in _CN_DIGITS:
+            number = _CN_DIGITS[token]
+        elif token in _CN_UNITS:
+            section += (number or 1) * _CN_UNITS[token]
+            number = 0
+        elif token == '万':
+            total += (section + number) * 10000
+            section, number = 0, 0
+        else:
+            number = float(token)
+    return int(total + section + number)
+
+
+def extract_keyword(text: str) -> Tuple[str, Optional[str]]:
+    """提取 "关键词:xxx" 形式的关键词，返回(去掉关键词后的指令, 关键词)"""
+    match = _KEYWORD_RE.search(text)
+    if not match:
+        return text, None
+    return text[:match.start()] + text[match.end():], match.group(1)
+
+
+def normalize(text: str) -> str:
+    """统一全角字符、中文数字和空白，结果也用作大模型解析结果的缓存key"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = re.sub(r"\s+", "", text)
+    # "一下" 不是数量
+    text = text.replace("一下", "下")
+    return _CN_NUMBER_RE.sub(lambda m: str(cn_to_int(m.group(0))), text)
+
+
+def parse(text: str) -> Optional[Tuple[Optional[int], Optional[int]]]:
+    """解析总结指令中的数量和时长
+
+    Args:
+        text: 去掉触发词和@用户名后的指令内容，例如 "3小时内的前99条消息"
+
+    Returns:
+        (消息数量, 时长(秒))，未提供的项为None；无法确定含义时返回None
+    """
+    text = normalize(text)
+    duration = None
+
+    if _TODAY_RE.search(text):
+        now = datetime.datetime.now()
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        duration = int((now - midnight).total_seconds())
+        text = _TODAY_RE.sub("", text)
+
+    text = _HALF_RE.sub(lambda m: "{}.5".format(m.group(1) or 0), text)
+    for value, unit in _DURATION_RE.findall(text):
+        duration = (duration or 0) + int(float(value) * _DURATION_UNITS[unit])
+    text = _DURATION_RE.sub("", text)
+
+    counts = []
+    for count_re in _COUNT_RES:
+        counts.extend(int(value) for value in count_re.findall(text))
+        text = count_re.sub("", text)
+    if not counts and (match := _BARE_NUMBER_RE.match(text)):
+        counts.append(int(match.group(1)))
+        text = ""
+    if len(set(counts)) > 1:
+        return None
+
+    if _FILLER_RE.sub("", text):
+        return None
+    return (counts[0] if counts else None), duration
+
+
+class ParseCache:
+    """大模型解析结果的LRU缓存，key为normalize后的指令"""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
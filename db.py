@@ -7,160 +7,823 @@
 @description  sqlite操作
 @Copyright (c) 2022 by sineom, All Rights Reserved.
 """
-import datetime
+import atexit
+import json
 import os
+import queue
 import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from urllib.request import pathname2url
 
 from common.log import logger
+from plugins.plugin_summary import metrics
+from plugins.plugin_summary.archive import SegmentArchive
+
+
+# 读写连接共用的pragma
+_COMMON_PRAGMAS = (
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16000",  # 约16MB页缓存
+    "PRAGMA mmap_size = 268435456",  # 256MB内存映射
+    "PRAGMA temp_store = MEMORY",
+)
+
+# 总结需要的列，时间的格式化由预处理完成
+_RECORD_COLUMNS = "r.msgid, u.name AS user, r.content, r.timestamp"
+_RECORD_FROM = "chat_records r JOIN users u ON u.id = r.user_id"
+
+
+def _migrate_v1(c):
+    """初始表结构，兼容没有is_triggered字段的旧库"""
+    c.execute('''CREATE TABLE IF NOT EXISTS chat_records
+                        (sessionid TEXT, msgid INTEGER, user TEXT, content TEXT, type TEXT, timestamp TEXT, is_triggered INTEGER, create_time TEXT,
+                        PRIMARY KEY (sessionid, msgid))''')
+
+    # 创建一个总结时间表，记录合适开始了总结的时间
+    c.execute('''CREATE TABLE IF NOT EXISTS summary_time
+                        (sessionid TEXT, summary_time INTEGER, PRIMARY KEY (sessionid))''')
+
+    # 创建一个关闭保存聊天记录的表
+    c.execute('''CREATE TABLE IF NOT EXISTS summary_stop
+                        (sessionid TEXT, PRIMARY KEY (sessionid))''')
+
+    columns = [column[1] for column in c.execute("PRAGMA table_info(chat_records)").fetchall()]
+    if 'is_triggered' not in columns:
+        c.execute("ALTER TABLE chat_records ADD COLUMN is_triggered INTEGER DEFAULT 0")
+        c.execute("UPDATE chat_records SET is_triggered = 0")
+
+
+def _migrate_v2(c):
+    """timestamp 改为 INTEGER，去掉冗余的 create_time，增加按会话和时间的索引"""
+    c.execute('''CREATE TABLE chat_records_v2
+                        (sessionid TEXT NOT NULL, msgid INTEGER NOT NULL, user TEXT, content TEXT, type TEXT,
+                        timestamp INTEGER NOT NULL, is_triggered INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (sessionid, msgid))''')
+    c.execute('''INSERT OR REPLACE INTO chat_records_v2
+                        SELECT sessionid, msgid, user, content, type, CAST(timestamp AS INTEGER), COALESCE(is_triggered, 0)
+                        FROM chat_records''')
+    c.execute("DROP TABLE chat_records")
+    c.execute("ALTER TABLE chat_records_v2 RENAME TO chat_records")
+    # iter_records 按会话+时间过滤并按时间排序
+    c.execute("CREATE INDEX idx_chat_records_session_time ON chat_records (sessionid, timestamp)")
+    # delete_records 只按时间过滤
+    c.execute("CREATE INDEX idx_chat_records_time ON chat_records (timestamp)")
+
+
+def _migrate_v3(c):
+    """用户名存入 users 表，chat_records 只保存用户的整数id"""
+    c.execute('''CREATE TABLE users
+                        (id INTEGER PRIMARY KEY, sessionid TEXT NOT NULL, name TEXT NOT NULL,
+                        UNIQUE (sessionid, name))''')
+    c.execute("INSERT OR IGNORE INTO users (sessionid, name) SELECT DISTINCT sessionid, COALESCE(user, '') FROM chat_records")
+    c.execute('''CREATE TABLE chat_records_v3
+                        (sessionid TEXT NOT NULL, msgid INTEGER NOT NULL, user_id INTEGER NOT NULL, content TEXT, type TEXT,
+                        timestamp INTEGER NOT NULL, is_triggered INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (sessionid, msgid))''')
+    c.execute('''INSERT INTO chat_records_v3
+                        SELECT r.sessionid, r.msgid, u.id, r.content, r.type, r.timestamp, r.is_triggered
+                        FROM chat_records r JOIN users u ON u.sessionid = r.sessionid AND u.name = COALESCE(r.user, '')''')
+    c.execute("DROP TABLE chat_records")
+    c.execute("ALTER TABLE chat_records_v3 RENAME TO chat_records")
+    c.execute("CREATE INDEX idx_chat_records_session_time ON chat_records (sessionid, timestamp)")
+    c.execute("CREATE INDEX idx_chat_records_time ON chat_records (timestamp)")
+    # 按@用户总结时走 user_id IN (...) 查询
+    c.execute("CREATE INDEX idx_chat_records_session_user ON chat_records (sessionid, user_id, timestamp)")
+
+
+def _migrate_v4(c):
+    """summary_time 中保存每个会话滚动更新的总结，以及它覆盖的聊天记录范围"""
+    c.execute("ALTER TABLE summary_time ADD COLUMN digest TEXT")
+    c.execute("ALTER TABLE summary_time ADD COLUMN digest_start INTEGER")
+    c.execute("ALTER TABLE summary_time ADD COLUMN digest_end INTEGER")
+    c.execute("ALTER TABLE summary_time ADD COLUMN digest_msgid INTEGER")
+
+
+def _migrate_v5(c):
+    """总结结果缓存"""
+    c.execute('''CREATE TABLE summary_cache
+                        (key TEXT PRIMARY KEY, sessionid TEXT NOT NULL, content TEXT NOT NULL, image BLOB,
+                        created INTEGER NOT NULL)''')
+    c.execute("CREATE INDEX idx_summary_cache_created ON summary_cache (created)")
+
+
+def _migrate_v6(c):
+    """预先生成的拒绝回复"""
+    c.execute('''CREATE TABLE canned_replies
+                        (id INTEGER PRIMARY KEY, kind TEXT NOT NULL, content TEXT NOT NULL)''')
+    c.execute("CREATE INDEX idx_canned_replies_kind ON canned_replies (kind)")
+
+
+def _migrate_v7(c):
+    """聊天内容的全文索引，trigram 分词支持中文；SQLite 不支持 FTS5 时跳过，关键词查询改为逐条匹配"""
+    try:
+        c.execute("CREATE VIRTUAL TABLE chat_records_fts USING fts5(content, content='chat_records', "
+                  "content_rowid='rowid', tokenize='trigram')")
+    except sqlite3.OperationalError as e:
+        logger.warning("[Summary] full-text index is disabled: %s", e)
+        return
+    # INSERT OR REPLACE 删除旧记录时也会触发删除触发器(需要开启 recursive_triggers)
+    c.execute('''CREATE TRIGGER chat_records_fts_insert AFTER INSERT ON chat_records BEGIN
+                        INSERT INTO chat_records_fts (rowid, content) VALUES (new.rowid, new.content);
+                        END''')
+    c.execute('''CREATE TRIGGER chat_records_fts_delete AFTER DELETE ON chat_records BEGIN
+                        INSERT INTO chat_records_fts (chat_records_fts, rowid, content)
+                        VALUES ('delete', old.rowid, old.content);
+                        END''')
+    c.execute('''CREATE TRIGGER chat_records_fts_update AFTER UPDATE OF content ON chat_records BEGIN
+                        INSERT INTO chat_records_fts (chat_records_fts, rowid, content)
+                        VALUES ('delete', old.rowid, old.content);
+                        INSERT INTO chat_records_fts (rowid, content) VALUES (new.rowid, new.content);
+                        END''')
+    # 已有记录的索引在迁移完成后再建，见 Db._migrate
+
+
+def _migrate_v8(c):
+    """归档文件索引，每个会话每天一个文件"""
+    c.execute('''CREATE TABLE archive_segments
+                        (sessionid TEXT NOT NULL, day TEXT NOT NULL, path TEXT NOT NULL, start_ts INTEGER NOT NULL,
+                        end_ts INTEGER NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (sessionid, day))''')
+
+
+def _migrate_v9(c):
+    """总结缓存按条记录过期时间，预先生成的总结比普通缓存保留更久；旧的缓存直接过期"""
+    c.execute("ALTER TABLE summary_cache ADD COLUMN expires INTEGER NOT NULL DEFAULT 0")
+    c.execute("CREATE INDEX idx_summary_cache_expires ON summary_cache (expires)")
+
+
+# 按顺序执行的数据库迁移，版本号记录在 PRAGMA user_version 中，只能追加不能修改
+_MIGRATIONS = [_migrate_v1, _migrate_v2, _migrate_v3, _migrate_v4, _migrate_v5, _migrate_v6, _migrate_v7,
+               _migrate_v8, _migrate_v9]
+
+
+def _start_condition(start_timestamp, after_msgid):
+    """起始时间的筛选条件，指定after_msgid时还包含起始时间当秒、消息id大于after_msgid的记录"""
+    if after_msgid is None:
+        return " AND r.timestamp>?", [start_timestamp or 0]
+    return " AND (r.timestamp, r.msgid)>(?,?)", [start_timestamp or 0, after_msgid]
 
 
 class Db:
-    def __init__(self):
+    def __init__(self, batch_size: int = 100, flush_interval: int = 500, read_pool_size: int = 2,
+                 archive_dir: str = None, db_path: str = None):
+        """
+        :param batch_size: 写缓冲中积累多少条消息后立即落库
+        :param flush_interval: 写缓冲最长停留时间(毫秒)
+        :param read_pool_size: 只读连接池大小
+        :param archive_dir: 归档文件目录，默认为插件目录下的 archive
+        :param db_path: 数据库文件路径，默认为插件目录下的 chat.db
+        """
         curdir = os.path.dirname(__file__)
-        db_path = os.path.join(curdir, "chat.db")
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
-        c = self.conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS chat_records
-                            (sessionid TEXT, msgid INTEGER, user TEXT, content TEXT, type TEXT, timestamp TEXT, is_triggered INTEGER, create_time TEXT,
-                            PRIMARY KEY (sessionid, msgid))''')
-
-        # 创建一个总结时间表，记录合适开始了总结的时间
-        c.execute('''CREATE TABLE IF NOT EXISTS summary_time
-                            (sessionid TEXT, summary_time INTEGER, PRIMARY KEY (sessionid))''')
-
-        # 创建一个关闭保存聊天记录的表
-        c.execute('''CREATE TABLE IF NOT EXISTS summary_stop
-                            (sessionid TEXT, PRIMARY KEY (sessionid))''')
-
-        # 后期增加了is_triggered字段，这里做个过渡，这段代码某天会删除
-        c = c.execute("PRAGMA table_info(chat_records);")
-        column_exists = False
-        for column in c.fetchall():
-            logger.debug("[Summary] column: {}".format(column))
-            if column[1] == 'is_triggered':
-                column_exists = True
-                break
-        if not column_exists:
-            self.conn.execute("ALTER TABLE chat_records ADD COLUMN is_triggered INTEGER DEFAULT 0;")
-            self.conn.execute("UPDATE chat_records SET is_triggered = 0;")
-
-        self.conn.commit()
-        # 禁用的群聊
-        self.disable_group = self._get_summary_stop()
+        self.db_path = db_path or os.path.join(curdir, "chat.db")
+        self.archive = SegmentArchive(archive_dir or os.path.join(curdir, "archive"))
+        # 写连接只有一个，所有写操作都通过_write_lock串行执行
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # 删除的记录占用的空间通过 incremental_vacuum 逐步归还，新库需要在建表前设置
+        self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # WAL模式下读写互不阻塞，synchronous=NORMAL在WAL下不会损坏数据库
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        # 全文索引依赖触发器同步，INSERT OR REPLACE 替换旧记录时也要触发删除触发器
+        self.conn.execute("PRAGMA recursive_triggers = ON")
+        for pragma in _COMMON_PRAGMAS:
+            self.conn.execute(pragma)
+        self._migrate()
+        self.fts_enabled = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='chat_records_fts'").fetchone() is not None
+
+        # 只读连接池，总结等大查询走只读连接，不会阻塞消息写入
+        self._read_pool_size = max(int(read_pool_size), 1)
+        self._read_pool = queue.Queue()
+        self._read_conns = 0
+        self._read_pool_lock = threading.Lock()
+
+        # 最近一次清理过期记录的统计
+        self.cleanup_stats = None
+
+        # 写缓冲：消息先进入内存队列，由后台线程按批次写入，避免每条消息一次commit
+        self.batch_size = max(int(batch_size), 1)
+        self.flush_interval = max(int(flush_interval), 0) / 1000
+        self._pending = []
+        self._pending_cond = threading.Condition()
+        # 保证同一时刻只有一个线程在写库，同时保证flush的先后顺序
+        self._write_lock = threading.RLock()
+        self._closed = False
+        # (sessionid, 用户名) -> users.id，只在写线程中访问
+        self._user_ids = {}
+        self._flusher = threading.Thread(target=self._flush_loop, name="summary-db-flusher", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
 
     def insert_record(self, session_id, msg_id, user, content, msg_type, timestamp, is_triggered=0):
-        c = self.conn.cursor()
-        # 10位timestamp 转换为易读的时间
-        create_time = datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
-        logger.debug("[Summary] insert record: {} {} {} {} {} {} {} {}".format(session_id, msg_id, user, content, msg_type,
-                                                                            timestamp, is_triggered, create_time))
-        c.execute("INSERT OR REPLACE INTO chat_records VALUES (?,?,?,?,?,?,?,?)",
-                  (session_id, msg_id, user, content, msg_type, timestamp, is_triggered, create_time))
-        self.conn.commit()
+        row = (session_id, msg_id, user, content, msg_type, int(timestamp), is_triggered)
+        with self._pending_cond:
+            closed = self._closed
+            if not closed:
+                self._pending.append(row)
+                # 第一条消息唤醒后台线程开始计时，攒满一批时唤醒立即写入
+                if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                    self._pending_cond.notify()
+        if closed:
+            # 已关闭时直接落库，不再经过缓冲
+            self._write_rows([row])
+
+    def flush(self):
+        """将写缓冲中的消息一次性写入数据库"""
+        with self._write_lock:
+            with self._pending_cond:
+                rows, self._pending = self._pending, []
+            if rows:
+                self._write_rows(rows)
+
+    def close(self):
+        """停止后台写线程并写入剩余的消息"""
+        with self._pending_cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._pending_cond.notify()
+        self._flusher.join(timeout=5)
+        self.flush()
+        while not self._read_pool.empty():
+            self._read_pool.get_nowait().close()
+
+    def _migrate(self):
+        """将数据库结构升级到最新版本"""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        for target in range(version + 1, len(_MIGRATIONS) + 1):
+            logger.info("[Summary] migrating database to version %d", target)
+            c = self.conn.cursor()
+            c.execute("BEGIN")
+            try:
+                _MIGRATIONS[target - 1](c)
+                c.execute("PRAGMA user_version = %d" % target)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+        # 旧库重建了 chat_records 需要回收空间，旧库也需要 VACUUM 一次 auto_vacuum 才会生效
+        if version < 3 or self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            if version:
+                logger.info("[Summary] vacuuming database, this may take a while")
+            self._vacuum()
+        elif version < 7:
+            # 新建的全文索引导入已有的记录；需要 VACUUM 时在 VACUUM 之后只重建一次
+            self._rebuild_fts()
+
+    def _vacuum(self):
+        self.conn.execute("VACUUM")
+        # VACUUM 可能改变 chat_records 的 rowid，需要重建全文索引
+        self._rebuild_fts()
+
+    def _rebuild_fts(self):
+        if self.conn.execute("SELECT 1 FROM sqlite_master WHERE name='chat_records_fts'").fetchone():
+            with self.conn:
+                self.conn.execute("INSERT INTO chat_records_fts (chat_records_fts) VALUES ('rebuild')")
+
+    def _connect_reader(self):
+        uri = "file:{}?mode=ro".format(pathname2url(os.path.abspath(self.db_path)))
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        for pragma in _COMMON_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def _reader(self):
+        """从连接池借出一个只读连接，池中没有空闲连接且已达上限时等待归还"""
+        try:
+            conn = self._read_pool.get_nowait()
+        except queue.Empty:
+            with self._read_pool_lock:
+                create = self._read_conns < self._read_pool_size
+                if create:
+                    self._read_conns += 1
+            if create:
+                try:
+                    conn = self._connect_reader()
+                except Exception:
+                    with self._read_pool_lock:
+                        self._read_conns -= 1
+                    raise
+            else:
+                conn = self._read_pool.get()
+        try:
+            yield conn
+        finally:
+            self._read_pool.put(conn)
+
+    def _write_rows(self, rows):
+        with self._write_lock:
+            started = time.perf_counter()
+            try:
+                self._insert_rows(rows)
+                logger.debug("[Summary] flushed %d records", len(rows))
+            except Exception as e:
+                # 一条有问题的消息不能导致整批丢失，逐条重试，只丢弃写入失败的消息
+                logger.warning("[Summary] failed to flush %d records, retrying one by one: %s", len(rows), e)
+                for row in rows:
+                    try:
+                        self._insert_rows([row])
+                    except Exception as e:
+                        logger.error("[Summary] failed to save record %s of %s: %s", row[1], row[0], e)
+            metrics.observe("summary_db_flush_seconds", time.perf_counter() - started)
+            metrics.observe("summary_db_flush_rows", len(rows), buckets=metrics.COUNT_BUCKETS)
+
+    def _insert_rows(self, rows):
+        """在一个事务中写入消息，需持有写锁；失败时回滚并抛出异常"""
+        # 本批新建的用户，事务回滚后这些用户id并不存在，需要从缓存中移除
+        added = []
+        try:
+            with self.conn:
+                records = [(session_id, msg_id, self._intern_user(session_id, user, added), content, msg_type,
+                            timestamp, is_triggered)
+                           for session_id, msg_id, user, content, msg_type, timestamp, is_triggered in rows]
+                self.conn.executemany("INSERT OR REPLACE INTO chat_records "
+                                      "(sessionid, msgid, user_id, content, type, timestamp, is_triggered) "
+                                      "VALUES (?,?,?,?,?,?,?)", records)
+        except Exception:
+            for key in added:
+                self._user_ids.pop(key, None)
+            raise
+
+    def _intern_user(self, session_id, user, added: list = None):
+        """获取用户名对应的id，不存在时新建，需在写事务中调用
+
+        :param added: 不为空时记录本次新缓存的用户，事务回滚时调用方需要把它们从缓存中移除
+        """
+        key = (session_id, user or '')
+        user_id = self._user_ids.get(key)
+        if user_id is None:
+            self.conn.execute("INSERT OR IGNORE INTO users (sessionid, name) VALUES (?,?)", key)
+            user_id = self.conn.execute("SELECT id FROM users WHERE sessionid=? AND name=?", key).fetchone()[0]
+            self._user_ids[key] = user_id
+            if added is not None:
+                added.append(key)
+        return user_id
+
+    @staticmethod
+    def _resolve_user_ids(conn, session_id, usernames) -> set:
+        """将@的用户名解析为用户id：优先精确匹配，其次前缀匹配，最后模糊匹配"""
+        user_ids = set()
+        for name in usernames:
+            rows = conn.execute("SELECT id FROM users WHERE sessionid=? AND name=?", (session_id, name)).fetchall()
+            if not rows:
+                # 范围查询可以使用 (sessionid, name) 唯一索引
+                rows = conn.execute("SELECT id FROM users WHERE sessionid=? AND name>=? AND name<?",
+                                    (session_id, name, name + "\U0010ffff")).fetchall()
+            if not rows:
+                rows = conn.execute("SELECT id FROM users WHERE sessionid=? AND instr(name, ?)>0",
+                                    (session_id, name)).fetchall()
+            user_ids.update(row[0] for row in rows)
+        return user_ids
+
+    @classmethod
+    def _resolve_usernames(cls, conn, session_id, usernames) -> set:
+        """将@的用户名解析为完整的用户名，用于筛选归档记录，与数据库中的记录按相同规则匹配"""
+        user_ids = cls._resolve_user_ids(conn, session_id, usernames)
+        if not user_ids:
+            return set()
+        return {row[0] for row in conn.execute("SELECT name FROM users WHERE id IN (SELECT value FROM json_each(?))",
+                                               (json.dumps(sorted(user_ids)),))}
+
+    def _flush_loop(self):
+        while True:
+            with self._pending_cond:
+                while not self._pending and not self._closed:
+                    self._pending_cond.wait()
+                # 未攒满一批时最多再等待flush_interval
+                if not self._closed and len(self._pending) < self.batch_size:
+                    self._pending_cond.wait(self.flush_interval)
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
 
     # 根据时间删除记录
-    def delete_records(self, start_timestamp):
+    def purge_records(self, before, session_before: dict = None, batch_size: int = 2000,
+                      vacuum_pages: int = 1000) -> dict:
+        """分批删除过期的聊天记录，每批单独提交，批次之间释放写锁，不会长时间阻塞消息写入
+
+        :param before: 默认的过期时间，早于该时间的记录被删除，为None时默认不删除
+        :param session_before: 单独设置过期时间的会话，会话id -> 过期时间，None表示永久保存
+        :param vacuum_pages: 删除后每次归还给文件系统的页数
+        :return: 删除的记录数、批次、耗时和数据库大小
+        """
+        started = time.time()
+        session_before = session_before or {}
+        stats = {"deleted": 0, "batches": 0}
+        # 条件中的{time}为时间列，删除聊天记录和清理滚动总结共用
+        targets = [("sessionid=? AND {time}<?", (session_id, session_time))
+                   for session_id, session_time in session_before.items() if session_time is not None]
+        if before is not None:
+            if session_before:
+                condition = "{time}<? AND sessionid NOT IN (" + ",".join("?" * len(session_before)) + ")"
+                targets.append((condition, (before, *session_before)))
+            else:
+                targets.append(("{time}<?", (before,)))
         try:
-            c = self.conn.cursor()
-            c.execute('''
-                        DELETE FROM chat_records
-                        WHERE timestamp < ?
-                    ''', start_timestamp,)
-            self.conn.commit()
-            logger.info("Records older have been cleaned.")
+            for condition, params in targets:
+                # 滚动总结的范围包含被删除的记录时不能再合并新消息，否则会一直保留已删除消息的内容
+                with self._write_lock:
+                    with self.conn:
+                        self.conn.execute("UPDATE summary_time SET digest=NULL, digest_start=NULL, digest_end=NULL, "
+                                          "digest_msgid=NULL WHERE " + condition.format(time="digest_start"), params)
+                sql = "DELETE FROM chat_records WHERE rowid IN (SELECT rowid FROM chat_records WHERE {} LIMIT ?)".format(
+                    condition.format(time="timestamp"))
+                while True:
+                    with self._write_lock:
+                        with self.conn:
+                            deleted = self.conn.execute(sql, (*params, batch_size)).rowcount
+                    stats["deleted"] += deleted
+                    stats["batches"] += 1
+                    if deleted < batch_size:
+                        break
+                    # 让出写锁，积压的消息可以在批次之间写入
+                    time.sleep(0.01)
+
+            # 分批归还空闲页，并把WAL中的内容写回数据库
+            initial_free = last_free = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+            while last_free:
+                with self._write_lock:
+                    # execute 只执行一步，每次只归还一页；executescript 会执行到结束
+                    self.conn.executescript("PRAGMA incremental_vacuum(%d);" % vacuum_pages)
+                    free_pages = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if free_pages >= last_free:
+                    break
+                last_free = free_pages
+            stats["freed_pages"] = initial_free - last_free
+            stats["expired_segments"] = self._purge_segments(before, session_before)
+            with self._write_lock:
+                self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+                page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+                stats["db_size"] = self.conn.execute("PRAGMA page_count").fetchone()[0] * page_size
         except Exception as e:
-            logger.error(e)
+            logger.error(f"[Summary] failed to clean records: {e}")
+            stats["error"] = str(e)
+        stats["duration"] = round(time.time() - started, 3)
+        self.cleanup_stats = stats
+        logger.info("[Summary] cleaned old records: %s", stats)
+        return stats
 
-    # 保存总结时间，如果表中不存在则插入，如果存在则更新
+    # 保存总结时间，不存在时插入，存在时只更新总结时间，不影响同一行中的滚动总结
     def save_summary_time(self, session_id, summary_time):
-        if self.get_summary_time(session_id) is None:
-            self._insert_summary_time(session_id, summary_time)
-        else:
-            self._update_summary_time(session_id, summary_time)
-
-    # 插入总结时间
-    def _insert_summary_time(self, session_id, summary_time):
-        c = self.conn.cursor()
-        logger.debug("[Summary] insert summary time: {} {}".format(session_id, summary_time))
-        c.execute("INSERT OR REPLACE INTO summary_time VALUES (?,?)",
-                  (session_id, summary_time))
-        self.conn.commit()
-
-    # 更新总结时间
-    def _update_summary_time(self, session_id, summary_time):
-        c = self.conn.cursor()
-        logger.debug("[Summary] update summary time: {} {}".format(session_id, summary_time))
-        c.execute("UPDATE summary_time SET summary_time = ? WHERE sessionid = ?",
-                  (summary_time, session_id))
-        self.conn.commit()
-    
-    # 获取总结时间，如果不存在返回None
-    def get_summary_time(self, session_id):
-        c = self.conn.cursor()
-        c.execute("SELECT summary_time FROM summary_time WHERE sessionid=?", (session_id,))
-        row = c.fetchone()
-        if row is None:
-            return None
-        return row[0]
-
-    def get_records(self, session_id, start_timestamp:int = None, limit:int = None, username: list[str]=None) -> list:
-        c = self.conn.cursor()
-        
+        logger.debug("[Summary] save summary time: %s %s", session_id, summary_time)
+        with self._write_lock:
+            self.conn.execute("INSERT INTO summary_time (sessionid, summary_time) VALUES (?,?) "
+                              "ON CONFLICT (sessionid) DO UPDATE SET summary_time = excluded.summary_time",
+                              (session_id, summary_time))
+            self.conn.commit()
+
+    # 获取会话滚动更新的总结，返回(总结, 覆盖的起始时间, 覆盖的结束时间, 最后一条消息id)，不存在返回None
+    def get_digest(self, session_id):
+        with self._reader() as conn:
+            row = conn.execute("SELECT digest, digest_start, digest_end, digest_msgid FROM summary_time "
+                               "WHERE sessionid=? AND digest IS NOT NULL", (session_id,)).fetchone()
+        return row
+
+    # 保存会话滚动更新的总结
+    def save_digest(self, session_id, digest, start_timestamp, end_timestamp, msg_id):
+        logger.debug("[Summary] save digest: %s %s-%s", session_id, start_timestamp, end_timestamp)
+        with self._write_lock:
+            self.conn.execute('''INSERT INTO summary_time (sessionid, digest, digest_start, digest_end, digest_msgid)
+                                VALUES (?,?,?,?,?)
+                                ON CONFLICT (sessionid) DO UPDATE SET digest = excluded.digest,
+                                digest_start = excluded.digest_start, digest_end = excluded.digest_end,
+                                digest_msgid = excluded.digest_msgid''',
+                              (session_id, digest, start_timestamp, end_timestamp, msg_id))
+            self.conn.commit()
+
+    # 获取since之后聊天记录不少于min_records条的会话，按记录数从多到少
+    def get_active_sessions(self, since, min_records: int = 1) -> list:
+        self.flush()
+        with self._reader() as conn:
+            rows = conn.execute("SELECT sessionid, COUNT(*) AS cnt FROM chat_records WHERE timestamp>? "
+                                "GROUP BY sessionid HAVING cnt>=? ORDER BY cnt DESC", (since, min_records)).fetchall()
+        return [row[0] for row in rows]
+
+    # 会话在(start_timestamp, end_timestamp)之间是否有聊天记录
+    def has_records(self, session_id, start_timestamp, end_timestamp) -> bool:
+        self.flush()
+        with self._reader() as conn:
+            row = conn.execute("SELECT 1 FROM chat_records WHERE sessionid=? AND timestamp>? AND timestamp<? LIMIT 1",
+                               (session_id, start_timestamp or 0, end_timestamp)).fetchone()
+        return row is not None
+
+    # 统计会话在[start_timestamp, end_timestamp]内的发言人数，以及发言最多的limit个用户及其发言数
+    # username不为空时只统计这些用户的发言，与总结的用户筛选一致
+    def get_speaker_stats(self, session_id, start_timestamp, end_timestamp, limit: int = 5, username: list = None):
+        archived = Counter(user for user, _ in self._iter_archived_stats(session_id, start_timestamp, end_timestamp,
+                                                                          username))
+        # 只用到(sessionid, user_id, timestamp)索引，不需要读取聊天内容
+        with self._reader() as conn:
+            condition, params = self._stats_condition(conn, session_id, start_timestamp, end_timestamp, username)
+            counts = conn.execute("SELECT user_id, COUNT(*) AS cnt FROM chat_records WHERE " + condition +
+                                  " GROUP BY user_id", params).fetchall()
+            # 有归档记录时按用户名合并，需要所有发言者的用户名
+            named = counts if archived else sorted(counts, key=lambda row: row[1], reverse=True)[:limit]
+            names = dict(conn.execute("SELECT id, name FROM users WHERE id IN (SELECT value FROM json_each(?))",
+                                      (json.dumps([user_id for user_id, _ in named]),)).fetchall()) if named else {}
+        if not archived:
+            return len(counts), [(names.get(user_id, ""), count) for user_id, count in named]
+        for user_id, count in named:
+            archived[names.get(user_id, "")] += count
+        return len(archived), archived.most_common(limit)
+
+    # 统计会话在[start_timestamp, end_timestamp]内每小时的消息数，返回[(小时, 消息数)]，按小时升序
+    def get_hourly_activity(self, session_id, start_timestamp, end_timestamp, username: list = None):
+        hourly = Counter(time.localtime(timestamp).tm_hour for _, timestamp in
+                         self._iter_archived_stats(session_id, start_timestamp, end_timestamp, username))
+        with self._reader() as conn:
+            condition, params = self._stats_condition(conn, session_id, start_timestamp, end_timestamp, username)
+            hourly.update(dict(conn.execute(
+                "SELECT CAST(strftime('%H', timestamp, 'unixepoch', 'localtime') AS INTEGER) AS hour, "
+                "COUNT(*) FROM chat_records WHERE " + condition + " GROUP BY hour", params).fetchall()))
+        return sorted(hourly.items())
+
+    def _stats_condition(self, conn, session_id, start_timestamp, end_timestamp, username):
+        """统计的筛选条件，指定username时按总结相同的规则解析为用户id"""
+        condition = "sessionid=? AND timestamp BETWEEN ? AND ?"
+        params = [session_id, start_timestamp or 0, end_timestamp]
+        if username:
+            condition += " AND user_id IN (SELECT value FROM json_each(?))"
+            params.append(json.dumps(sorted(self._resolve_user_ids(conn, session_id, username))))
+        return condition, params
+
+    def _iter_archived_stats(self, session_id, start_timestamp, end_timestamp, username):
+        """统计范围内归档记录的(用户名, 时间)，范围不包含归档记录时不读取文件"""
+        with self._reader() as conn:
+            segments = conn.execute("SELECT path FROM archive_segments WHERE sessionid=? AND end_ts>=? AND start_ts<=?",
+                                    (session_id, start_timestamp or 0, end_timestamp)).fetchall()
+            names = self._resolve_usernames(conn, session_id, username) if username and segments else None
+        for (path,) in segments:
+            for row in self.archive.read(path):
+                if ((start_timestamp or 0) <= row["timestamp"] <= end_timestamp
+                        and (names is None or (row["user"] or "") in names)):
+                    yield row["user"] or "", row["timestamp"]
+
+    # 获取会话最新一条聊天记录的(时间, 消息id)，没有记录返回None
+    def get_last_record(self, session_id):
+        self.flush()
+        with self._reader() as conn:
+            return conn.execute("SELECT timestamp, msgid FROM chat_records WHERE sessionid=? "
+                                "ORDER BY timestamp DESC, msgid DESC LIMIT 1", (session_id,)).fetchone()
+
+    # 获取缓存的总结，返回(过期时间, 总结文本, 图片)，不存在或在now之前已过期返回None
+    def get_cached_summary(self, key, now):
+        with self._reader() as conn:
+            return conn.execute("SELECT expires, content, image FROM summary_cache WHERE key=? AND expires>?",
+                                (key, now)).fetchone()
+
+    # 保存总结缓存，同时清理在now之前已过期的缓存
+    def save_cached_summary(self, key, session_id, entry, now):
+        expires, content, image = entry
+        with self._write_lock:
+            self.conn.execute("INSERT OR REPLACE INTO summary_cache (key, sessionid, content, image, created, expires) "
+                              "VALUES (?,?,?,?,?,?)", (key, session_id, content, image, now, expires))
+            self.conn.execute("DELETE FROM summary_cache WHERE expires<=?", (now,))
+            self.conn.commit()
+
+    # 获取某一类预先生成的回复
+    def get_canned_replies(self, kind) -> list:
+        with self._reader() as conn:
+            return [row[0] for row in conn.execute("SELECT content FROM canned_replies WHERE kind=?", (kind,))]
+
+    # 用replies替换某一类预先生成的回复
+    def save_canned_replies(self, kind, replies):
+        with self._write_lock:
+            self.conn.execute("DELETE FROM canned_replies WHERE kind=?", (kind,))
+            self.conn.executemany("INSERT INTO canned_replies (kind, content) VALUES (?,?)",
+                                  [(kind, reply) for reply in replies])
+            self.conn.commit()
+
+    def iter_records(self, session_id, start_timestamp: int = None, limit: int = None, username: list[str] = None,
+                     keyword: str = None, context: int = 2, batch_size: int = 500, after_msgid: int = None):
+        """按时间倒序逐批读取聊天记录，每条为(msgid, user, content, timestamp)
+
+        只读取start_timestamp之后的记录；指定after_msgid时从(start_timestamp, after_msgid)这条记录之后开始读取，
+        包含同一秒内的后续记录。
+        指定keyword时只读取包含关键词的记录及其前后各context条记录，此时username只用于筛选包含关键词的记录。
+        数据库中的记录读完后继续读取时间范围内的归档记录。
+        读取过程中占用一个只读连接，提前结束时需要调用生成器的 close()
+        """
+        # 先把缓冲中的消息落库，保证总结包含最新的聊天记录
+        self.flush()
+
+        # 如果没有指定limit，则根据用户数量设置limit
+        if username and limit is None:
+            limit = len(username) * 250
+
+        count = yield from self._iter_hot_records(session_id, start_timestamp, after_msgid, limit, username, keyword,
+                                                  context, batch_size)
+        if not limit or count < limit:
+            yield from self._iter_archived_records(session_id, start_timestamp, after_msgid,
+                                                   limit - count if limit else None, username, keyword, context)
+
+    def _iter_hot_records(self, session_id, start_timestamp, after_msgid, limit, username, keyword, context,
+                          batch_size):
+        """读取数据库中的聊天记录，返回读取的条数"""
         # 构建基础SQL查询
-        sql = "SELECT * FROM chat_records WHERE sessionid=?"
+        sql = "SELECT {} FROM {} WHERE r.sessionid=?".format(_RECORD_COLUMNS, _RECORD_FROM)
         params = [session_id]
 
         # 添加时间筛选条件
         if start_timestamp:
-            sql += " AND timestamp>?"
-            params.append(start_timestamp)
-        
-        # 添加用户名筛选条件
-        if username:
-            # 将搜索条件按@分割成多个用户名,并去掉@符号
-            sql += " AND ("
-            sql += " OR ".join(["user LIKE ?" for _ in username])
-            sql += ")"
-            params.extend(["%" + u + "%" for u in username])
-            # 如果没有指定limit，则根据用户数量设置limit
-            if limit is None:
-                limit = len(username) * 250
-
-        # 添加排序和限制条件
-        sql += " ORDER BY timestamp DESC"
-        if limit:
-            sql += " LIMIT ?"
-            params.append(limit)
-
-        c.execute(sql, params)
-        return c.fetchall()
+            condition, condition_params = _start_condition(start_timestamp, after_msgid)
+            sql += condition
+            params.extend(condition_params)
+
+        count = 0
+        with self._reader() as conn:
+            # 添加用户名筛选条件
+            user_ids = None
+            if username:
+                user_ids = self._resolve_user_ids(conn, session_id, username)
+                if not user_ids:
+                    return count
+                if not keyword:
+                    sql += " AND r.user_id IN ({})".format(",".join("?" * len(user_ids)))
+                    params.extend(user_ids)
+
+            # 添加关键词筛选条件
+            if keyword:
+                rowids = self._keyword_rowids(conn, session_id, start_timestamp, after_msgid, keyword, user_ids,
+                                              context)
+                if not rowids:
+                    return count
+                sql += " AND r.rowid IN (SELECT value FROM json_each(?))"
+                params.append(json.dumps(rowids))
+
+            # 添加排序和限制条件
+            sql += " ORDER BY r.timestamp DESC"
+            if limit:
+                sql += " LIMIT ?"
+                params.append(limit)
+
+            # 只统计查询本身的耗时，不包括调用方处理记录的时间
+            query_time = 0.0
+            started = time.perf_counter()
+            cursor = conn.execute(sql, params)
+            try:
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    query_time += time.perf_counter() - started
+                    if not rows:
+                        break
+                    count += len(rows)
+                    yield from rows
+                    started = time.perf_counter()
+            finally:
+                cursor.close()
+                metrics.observe("summary_db_query_seconds", query_time)
+                metrics.observe("summary_db_query_rows", count, buckets=metrics.COUNT_BUCKETS)
+        return count
+
+    def _iter_archived_records(self, session_id, start_timestamp, after_msgid, limit, username, keyword, context):
+        """按时间倒序读取归档文件中的聊天记录，逐个文件读取，不占用数据库连接"""
+        with self._reader() as conn:
+            segments = conn.execute("SELECT path FROM archive_segments WHERE sessionid=? AND end_ts>=? "
+                                    "ORDER BY start_ts DESC", (session_id, start_timestamp or 0)).fetchall()
+            names = self._resolve_usernames(conn, session_id, username) if username and segments else None
+        start = start_timestamp or 0
+        count = 0
+        for (path,) in segments:
+            with metrics.timer("summary_archive_read_seconds"):
+                rows = [row for row in self.archive.read(path) if row["timestamp"] > start or (
+                        after_msgid is not None and row["timestamp"] == start and row["msgid"] > after_msgid)]
+            if keyword:
+                hits = [index for index, row in enumerate(rows) if keyword in (row["content"] or "")
+                        and (names is None or (row["user"] or "") in names)]
+                selected = sorted({i for index in hits
+                                   for i in range(max(index - context, 0), min(index + context + 1, len(rows)))})
+                rows = [rows[index] for index in selected]
+            elif names is not None:
+                rows = [row for row in rows if (row["user"] or "") in names]
+            for row in reversed(rows):
+                yield row["msgid"], row["user"], row["content"], row["timestamp"]
+                count += 1
+                if limit and count >= limit:
+                    return
+
+    def archive_records(self, before, batch_size: int = 2000) -> int:
+        """将早于before的聊天记录移到归档文件中，分批执行，返回归档的条数"""
+        started = time.time()
+        total = 0
+        try:
+            while True:
+                with self._write_lock:
+                    rows = self.conn.execute(
+                        "SELECT r.rowid, r.sessionid, r.msgid, u.name, r.content, r.type, r.timestamp, r.is_triggered "
+                        "FROM {} WHERE r.timestamp<? ORDER BY r.timestamp LIMIT ?".format(_RECORD_FROM),
+                        (before, batch_size)).fetchall()
+                    if not rows:
+                        break
+                    # 按会话和日期分组写入归档文件，写入成功后再删除数据库中的记录
+                    segments = {}
+                    for rowid, session_id, *record in rows:
+                        day = time.strftime("%Y-%m-%d", time.localtime(record[4]))
+                        segments.setdefault((session_id, day), []).append(record)
+                    manifest = []
+                    for (session_id, day), records in segments.items():
+                        path = self.archive.segment_path(session_id, day)
+                        self.archive.append(path, records)
+                        manifest.append((session_id, day, path, records[0][4], records[-1][4], len(records)))
+                    with self.conn:
+                        self.conn.executemany(
+                            "INSERT INTO archive_segments (sessionid, day, path, start_ts, end_ts, count) "
+                            "VALUES (?,?,?,?,?,?) ON CONFLICT(sessionid, day) DO UPDATE SET "
+                            "start_ts=MIN(start_ts, excluded.start_ts), end_ts=MAX(end_ts, excluded.end_ts), "
+                            "count=count+excluded.count", manifest)
+                        self.conn.execute("DELETE FROM chat_records WHERE rowid IN (SELECT value FROM json_each(?))",
+                                          (json.dumps([row[0] for row in rows]),))
+                total += len(rows)
+                if len(rows) < batch_size:
+                    break
+                # 让出写锁，积压的消息可以在批次之间写入
+                time.sleep(0.01)
+        except Exception as e:
+            logger.error(f"[Summary] failed to archive records: {e}")
+        if total:
+            logger.info("[Summary] archived %d records in %.3fs", total, time.time() - started)
+        return total
+
+    def _purge_segments(self, before, session_before: dict) -> int:
+        """删除全部记录都已过期的归档文件，返回删除的文件数"""
+        with self._reader() as conn:
+            segments = conn.execute("SELECT sessionid, day, path, end_ts FROM archive_segments").fetchall()
+        expired = []
+        for session_id, day, path, end_ts in segments:
+            expire_before = session_before[session_id] if session_id in session_before else before
+            if expire_before is not None and end_ts < expire_before:
+                expired.append((session_id, day, path))
+        for session_id, day, path in expired:
+            with self._write_lock:
+                with self.conn:
+                    self.conn.execute("DELETE FROM archive_segments WHERE sessionid=? AND day=?", (session_id, day))
+            self.archive.remove(path)
+        return len(expired)
+
+    def _keyword_rowids(self, conn, session_id, start_timestamp, after_msgid, keyword, user_ids, context) -> list:
+        """包含关键词的聊天记录及其前后各context条记录的rowid"""
+        if self.fts_enabled and len(keyword) >= 3:
+            # CROSS JOIN 固定先查全文索引，否则查询计划可能先按会话扫描，再对每条记录单独执行一次 MATCH
+            sql = ("SELECT r.rowid, r.timestamp FROM chat_records_fts f CROSS JOIN chat_records r ON r.rowid = f.rowid "
+                   "WHERE chat_records_fts MATCH ?")
+            params = ['"{}"'.format(keyword.replace('"', '""'))]
+        else:
+            # trigram 分词至少需要3个字符，更短的关键词逐条匹配
+            sql = "SELECT r.rowid, r.timestamp FROM chat_records r WHERE instr(r.content, ?) > 0"
+            params = [keyword]
+        condition, condition_params = _start_condition(start_timestamp, after_msgid)
+        sql += " AND r.sessionid=?" + condition
+        params += [session_id] + condition_params
+        if user_ids:
+            sql += " AND r.user_id IN ({})".format(",".join("?" * len(user_ids)))
+            params.extend(user_ids)
+        hits = conn.execute(sql, params).fetchall()
+        selected = {rowid for rowid, _ in hits}
+        if not hits or context <= 0:
+            return list(selected)
+
+        # 按(时间, rowid)的顺序分别取每条命中记录前后的context条记录，只走(sessionid, timestamp)索引
+        for rowid, timestamp in hits:
+            selected.update(row[0] for row in conn.execute(
+                "SELECT r.rowid FROM chat_records r WHERE r.sessionid=?" + condition +
+                " AND (r.timestamp, r.rowid)<(?,?) ORDER BY r.timestamp DESC, r.rowid DESC LIMIT ?",
+                [session_id] + condition_params + [timestamp, rowid, context]))
+            selected.update(row[0] for row in conn.execute(
+                "SELECT rowid FROM chat_records WHERE sessionid=? AND (timestamp, rowid)>(?,?) "
+                "ORDER BY timestamp, rowid LIMIT ?", (session_id, timestamp, rowid, context)))
+        return list(selected)
 
     # 删除禁用的群聊
     def delete_summary_stop(self, session_id):
         try:
-            c = self.conn.cursor()
-            c.execute("DELETE FROM summary_stop WHERE sessionid=?", (session_id,))
-            self.conn.commit()
-            if session_id in self.disable_group:
-                self.disable_group.remove(session_id)
+            with self._write_lock:
+                c = self.conn.cursor()
+                c.execute("DELETE FROM summary_stop WHERE sessionid=?", (session_id,))
+                self.conn.commit()
         except Exception as e:
             logger.error(e)
 
     # 保存禁用的群聊
     def save_summary_stop(self, session_id):
         try:
-            c = self.conn.cursor()
-            c.execute("INSERT OR REPLACE INTO summary_stop VALUES (?)",
-                      (session_id,))
-            self.conn.commit()
-            self.disable_group.add(session_id)
+            with self._write_lock:
+                c = self.conn.cursor()
+                c.execute("INSERT OR REPLACE INTO summary_stop VALUES (?)",
+                          (session_id,))
+                self.conn.commit()
         except Exception as e:
             logger.error(e)
 
-    # 获取所有禁用的群聊
-    def _get_summary_stop(self):
-        c = self.conn.cursor()
-        c.execute("SELECT sessionid FROM summary_stop")
-        return set(c.fetchall())
+    # 获取所有禁用的群聊，以及各会话的上次总结时间
+    def load_session_states(self):
+        with self._reader() as conn:
+            disabled = {row[0] for row in conn.execute("SELECT sessionid FROM summary_stop")}
+            summary_times = dict(conn.execute("SELECT sessionid, summary_time FROM summary_time "
+                                              "WHERE summary_time IS NOT NULL").fetchall())
+        return disabled, summary_times
 
 
@@ -0,0 +1,51 @@
+# encoding:utf-8
+"""
+总结图片的编码
+
+总结图片以文字为主，可以压缩为调色板 PNG，或者转为 JPEG/WebP 进一步减小上传体积。
+"""
+import io
+
+# 配置的格式 -> Pillow 的格式名
+_FORMATS = {"png": "PNG", "jpeg": "JPEG", "jpg": "JPEG", "webp": "WEBP"}
+
+
+def extension(fmt: str) -> str:
+    """图片格式对应的文件扩展名"""
+    return "jpg" if _FORMATS.get((fmt or "png").lower()) == "JPEG" else (fmt or "png").lower()
+
+
+def save(image, fmt: str = "png", quality: int = 85, optimize: bool = False) -> bytes:
+    """将 Pillow 图片编码为指定格式
+
+    :param fmt: png、jpeg 或 webp
+    :param quality: JPEG/WebP 的质量(1-100)
+    :param optimize: PNG 是否转为256色调色板并压缩，文字图片肉眼看不出区别
+    """
+    pil_format = _FORMATS.get((fmt or "png").lower())
+    if pil_format is None:
+        raise ValueError(f"unsupported image format: {fmt}")
+    output = io.BytesIO()
+    if pil_format == "JPEG":
+        image.convert("RGB").save(output, "JPEG", quality=quality, optimize=True, progressive=True)
+    elif pil_format == "WEBP":
+        image.save(output, "WEBP", quality=quality, method=4)
+    elif optimize:
+        image.convert("RGB").quantize(colors=256).save(output, "PNG", optimize=True)
+    else:
+        image.save(output, "PNG")
+    return output.getvalue()
+
+
+def encode(data: bytes, fmt: str = "png", quality: int = 85, optimize: bool = False) -> bytes:
+    """重新编码PNG图片内容，不需要处理时原样返回"""
+    if (fmt or "png").lower() == "png" and not optimize:
+        return data
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        encoded = save(image, fmt, quality, optimize)
+    # 优化后的PNG反而更大时使用原图
+    if (fmt or "png").lower() == "png" and len(encoded) >= len(data):
+        return data
+    return encoded
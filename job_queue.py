@@ -0,0 +1,99 @@
+# encoding:utf-8
+"""
+总结任务队列
+
+总结任务在后台线程中执行，消息处理线程只负责提交任务；同一会话同时只能有一个任务，
+队列已满时直接拒绝新任务。
+"""
+import queue
+import threading
+import time
+
+from common.log import logger
+from plugins.plugin_summary import metrics
+
+# submit 的返回值
+ACCEPTED = "accepted"
+DUPLICATE = "duplicate"
+REJECTED = "rejected"
+
+
+class SummaryJob:
+    def __init__(self, session_id, func):
+        self.session_id = session_id
+        self.func = func
+        self.status = "queued"
+        self.created = time.time()
+        self.started = None
+
+
+class SummaryJobQueue:
+    def __init__(self, workers: int = 2, max_pending: int = 10):
+        """
+        :param workers: 同时执行的总结任务数量
+        :param max_pending: 排队等待的任务上限，超过时拒绝新任务
+        """
+        self.max_pending = max(int(max_pending), 0)
+        self._queue = queue.Queue()
+        # 会话id -> 排队中或执行中的任务
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        for index in range(max(int(workers), 1)):
+            threading.Thread(target=self._work, name=f"summary-worker-{index}", daemon=True).start()
+
+    def submit(self, session_id, func) -> str:
+        """提交一个总结任务，func 在后台线程中执行"""
+        with self._lock:
+            if session_id in self._jobs:
+                return DUPLICATE
+            if self._queue.qsize() >= self.max_pending:
+                self.rejected += 1
+                metrics.inc("summary_jobs_total", result="rejected")
+                return REJECTED
+            job = SummaryJob(session_id, func)
+            self._jobs[session_id] = job
+            self._queue.put(job)
+        return ACCEPTED
+
+    def is_active(self, session_id) -> bool:
+        """会话是否有排队中或执行中的任务"""
+        with self._lock:
+            return session_id in self._jobs
+
+    def status(self) -> str:
+        """任务状态，供管理员查看"""
+        now = time.time()
+        with self._lock:
+            jobs = list(self._jobs.values())
+            lines = [f"排队 {self._queue.qsize()} 个，执行中 {sum(job.status == 'running' for job in jobs)} 个，"
+                     f"已完成 {self.completed} 个，失败 {self.failed} 个，拒绝 {self.rejected} 个"]
+        for job in sorted(jobs, key=lambda j: j.created):
+            if job.status == "running":
+                lines.append(f"{job.session_id}：执行中 {now - job.started:.0f}秒")
+            else:
+                lines.append(f"{job.session_id}：排队中 {now - job.created:.0f}秒")
+        return "\n".join(lines)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.status = "running"
+            job.started = time.time()
+            logger.debug("[Summary] start job %s, waited %.1fs", job.session_id, job.started - job.created)
+            metrics.observe("summary_job_wait_seconds", job.started - job.created)
+            result = "completed"
+            try:
+                job.func()
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                result = "failed"
+                logger.exception(f"[Summary] summary job for {job.session_id} failed: {e}")
+            finally:
+                metrics.observe("summary_job_seconds", time.time() - job.started)
+                metrics.inc("summary_jobs_total", result=result)
+                with self._lock:
+                    self._jobs.pop(job.session_id, None)
@@ -0,0 +1,148 @@
+# encoding:utf-8
+"""
+大模型请求调度
+
+插件内所有大模型请求都经过这里：限制同时请求的数量，按优先级执行，同一优先级内各会话轮流执行，
+单个会话的大量分段请求不会让其他会话一直等待；请求超时或失败时按指数退避重试。
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from common.log import logger
+from plugins.plugin_summary import metrics
+
+# 优先级，数值越小越先执行
+PRIORITY_COMMAND = 0  # 指令解析，用户正在等待
+PRIORITY_SUMMARY = 1  # 生成总结
+PRIORITY_BACKGROUND = 2  # 拒绝回复等后台生成的内容
+_PRIORITY_NAMES = ("解析", "总结", "后台")
+# 指标中的优先级标签
+_PRIORITY_LABELS = ("command", "summary", "background")
+
+
+class _Request:
+    __slots__ = ("func", "priority", "fair_key", "future", "started", "enqueued")
+
+    def __init__(self, func, priority, fair_key):
+        self.func = func
+        self.priority = priority
+        self.fair_key = fair_key
+        self.future = Future()
+        self.started = threading.Event()
+        self.enqueued = time.time()
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency: int = 4, timeout: float = 120, retries: int = 2, backoff: float = 2):
+        """
+        :param max_concurrency: 同时进行的大模型请求上限
+        :param timeout: 单次请求开始执行后的超时时间(秒)，排队时间不计入
+        :param retries: 超时或出错后的重试次数
+        :param backoff: 第一次重试前等待的秒数，之后每次翻倍
+        """
+        self.max_concurrency = max(int(max_concurrency), 1)
+        self.timeout = timeout
+        self.retries = max(int(retries), 0)
+        self.backoff = backoff
+        # 每个优先级一个队列：公平键 -> 该键排队的请求，取出请求后把该键移到末尾实现轮流执行
+        self._queues = [OrderedDict() for _ in _PRIORITY_NAMES]
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._running = 0
+        self.completed = 0
+        self.errors = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.retried = 0
+        self._wait_total = 0.0
+        self._run_total = 0.0
+        for index in range(self.max_concurrency):
+            threading.Thread(target=self._work, name=f"summary-llm-{index}", daemon=True).start()
+
+    def call(self, func, priority: int = PRIORITY_SUMMARY, fair_key=None):
+        """在调度线程中执行func并返回结果，阻塞直到完成；重试后仍失败时抛出最后一次的异常"""
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.retried += 1
+                metrics.inc("summary_llm_retries_total", priority=_PRIORITY_LABELS[priority])
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            request = self._submit(func, priority, fair_key)
+            request.started.wait()
+            try:
+                return request.future.result(timeout=self.timeout)
+            except FutureTimeoutError as e:
+                # 超时的请求无法取消，会继续占用并发名额直到返回
+                self.timeouts += 1
+                metrics.inc("summary_llm_timeouts_total", priority=_PRIORITY_LABELS[priority])
+                error = e
+                logger.warning("[Summary] llm request for %s timed out after %ss", fair_key, self.timeout)
+            except Exception as e:
+                error = e
+                logger.warning("[Summary] llm request for %s failed: %s", fair_key, e)
+        self.failed += 1
+        metrics.inc("summary_llm_failed_total", priority=_PRIORITY_LABELS[priority])
+        raise error
+
+    def _submit(self, func, priority, fair_key) -> _Request:
+        request = _Request(func, priority, fair_key)
+        with self._cond:
+            self._queues[priority].setdefault(fair_key, deque()).append(request)
+            self._pending += 1
+            self._cond.notify()
+        return request
+
+    def _next(self) -> _Request:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            queue = next(q for q in self._queues if q)
+            fair_key, requests = next(iter(queue.items()))
+            request = requests.popleft()
+            if requests:
+                queue.move_to_end(fair_key)
+            else:
+                del queue[fair_key]
+            self._pending -= 1
+            self._running += 1
+            self._wait_total += time.time() - request.enqueued
+        metrics.observe("summary_llm_queue_seconds", time.time() - request.enqueued,
+                        priority=_PRIORITY_LABELS[request.priority])
+        return request
+
+    def _work(self):
+        while True:
+            request = self._next()
+            request.future.set_running_or_notify_cancel()
+            request.started.set()
+            started = time.time()
+            result = "ok"
+            try:
+                request.future.set_result(request.func())
+                self.completed += 1
+            except BaseException as e:
+                self.errors += 1
+                result = "error"
+                request.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._run_total += time.time() - started
+                priority = _PRIORITY_LABELS[request.priority]
+                metrics.observe("summary_llm_seconds", time.time() - started, priority=priority)
+                metrics.inc("summary_llm_requests_total", priority=priority, result=result)
+
+    def status(self) -> str:
+        """调度状态，供管理员查看"""
+        with self._cond:
+            queued = "/".join(f"{name} {sum(len(r) for r in q.values())}"
+                              for name, q in zip(_PRIORITY_NAMES, self._queues))
+            running = self._running
+            finished = self.completed + self.errors
+            avg_wait = self._wait_total / (finished + running) if finished + running else 0
+            avg_run = self._run_total / finished if finished else 0
+        return (f"大模型请求：排队({queued})，执行中 {running}/{self.max_concurrency}，完成 {self.completed} 个，"
+                f"出错 {self.errors} 次，超时 {self.timeouts} 次，重试 {self.retried} 次，失败 {self.failed} 个，"
+                f"平均排队 {avg_wait:.1f}秒，平均耗时 {avg_run:.1f}秒")
@@ -0,0 +1,223 @@
+# encoding:utf-8
+"""
+纯 Python 的总结图片渲染，不依赖浏览器和网络
+
+使用 Pillow 排版文本，支持中文逐字换行、英文按单词换行，以及 1️⃣、🔥 这类 emoji(需要彩色 emoji 字体)。
+"""
+import glob
+import os
+import threading
+
+from PIL import Image, ImageDraw, ImageFont
+
+from common.log import logger
+from plugins.plugin_summary import image_codec
+
+_CURDIR = os.path.dirname(os.path.abspath(__file__))
+
+# 未配置字体时按顺序查找，插件目录下 fonts 中的字体优先
+_DEFAULT_FONTS = [
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/google-noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+    "/usr/share/fonts/wqy-microhei/wqy-microhei.ttc",
+    "/System/Library/Fonts/PingFang.ttc",
+    "/System/Library/Fonts/STHeiti Medium.ttc",
+    "C:/Windows/Fonts/msyh.ttc",
+    "C:/Windows/Fonts/simhei.ttf",
+]
+_DEFAULT_EMOJI_FONTS = [
+    "/usr/share/fonts/truetype/noto/NotoColorEmoji.ttf",
+    "/usr/share/fonts/noto/NotoColorEmoji.ttf",
+    "/usr/share/fonts/google-noto-emoji/NotoColorEmoji.ttf",
+    "/System/Library/Fonts/Apple Color Emoji.ttc",
+    "C:/Windows/Fonts/seguiemj.ttf",
+]
+# Noto Color Emoji 是位图字体，只能以109的字号加载
+_EMOJI_BITMAP_SIZE = 109
+
+_VS16 = "\ufe0f"
+_KEYCAP = "\u20e3"
+_ZWJ = "\u200d"
+# 行首不能出现的标点
+_NO_LINE_START = set("，。、；：！？）》」』】,.;:!?)")
+
+
+def _find_font(configured, candidates):
+    if configured:
+        if not os.path.exists(configured):
+            raise FileNotFoundError(f"font not found: {configured}")
+        return configured
+    bundled = sorted(glob.glob(os.path.join(_CURDIR, "fonts", "*.[ot]t[fc]")))
+    for path in bundled + candidates:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _is_emoji_char(ch):
+    code = ord(ch)
+    return (0x1F000 <= code <= 0x1FAFF or 0x2600 <= code <= 0x27BF or 0x2B00 <= code <= 0x2BFF
+            or 0x2190 <= code <= 0x21FF or 0x2300 <= code <= 0x23FF)
+
+
+def _clusters(line):
+    """按字形切分：emoji 与其后的变体选择符、键帽、肤色和 ZWJ 序列合为一个字形"""
+    clusters = []
+    i = 0
+    while i < len(line):
+        cluster = line[i]
+        i += 1
+        while i < len(line):
+            ch = line[i]
+            code = ord(ch)
+            if ch in (_VS16, _KEYCAP) or 0x1F3FB <= code <= 0x1F3FF:
+                cluster += ch
+                i += 1
+            elif ch == _ZWJ and i + 1 < len(line):
+                cluster += line[i:i + 2]
+                i += 2
+            elif 0x1F1E6 <= code <= 0x1F1FF and len(cluster) == 1 and 0x1F1E6 <= ord(cluster) <= 0x1F1FF:
+                # 国旗由两个区域指示符组成
+                cluster += ch
+                i += 1
+            else:
+                break
+        clusters.append(cluster)
+    return clusters
+
+
+def _is_emoji(cluster):
+    return _VS16 in cluster or _KEYCAP in cluster or _is_emoji_char(cluster[0])
+
+
+def _plain(cluster):
+    """没有 emoji 字体时的替代文本，键帽数字 1️⃣ 显示为 1."""
+    return cluster.replace(_VS16, "").replace(_KEYCAP, ".")
+
+
+class LocalTextRenderer:
+    def __init__(self, font_path=None, emoji_font_path=None, width=800, font_size=28, padding=40,
+                 line_spacing=1.6, background=(255, 255, 255), color=(34, 34, 34), image_format="png",
+                 quality=85, optimize=False):
+        """
+        :param font_path: 正文字体，需包含中文字形；为空时自动查找
+        :param emoji_font_path: 彩色 emoji 字体；为空时自动查找，找不到则 emoji 用正文字体绘制
+        :param width: 图片宽度(像素)
+        :param image_format: 输出格式，png、jpeg 或 webp，参见 image_codec.save
+        """
+        font_path = _find_font(font_path, _DEFAULT_FONTS)
+        if font_path is None:
+            raise FileNotFoundError("no CJK font found, please set render_font in config.json")
+        self.font = ImageFont.truetype(font_path, font_size)
+        self.emoji_font = self._load_emoji_font(_find_font(emoji_font_path, _DEFAULT_EMOJI_FONTS), font_size)
+        self.width = width
+        self.font_size = font_size
+        self.padding = padding
+        self.line_height = int(font_size * line_spacing)
+        self.background = background
+        self.color = color
+        self.image_format = image_format
+        self.quality = quality
+        self.optimize = optimize
+        self._emoji_cache = {}
+        # FreeType 字体对象不是线程安全的
+        self._lock = threading.Lock()
+        logger.info("[Summary] local renderer uses font %s", font_path)
+
+    @staticmethod
+    def _load_emoji_font(path, font_size):
+        if path is None:
+            return None
+        for size in (font_size, _EMOJI_BITMAP_SIZE):
+            try:
+                return ImageFont.truetype(path, size)
+            except OSError:
+                continue
+        logger.warning("[Summary] failed to load emoji font %s", path)
+        return None
+
+    def _cluster_width(self, cluster):
+        if _is_emoji(cluster) and self.emoji_font is not None:
+            return self.font_size
+        return self.font.getlength(_plain(cluster))
+
+    def _wrap(self, text):
+        """排版：返回每一行的字形列表"""
+        max_width = self.width - 2 * self.padding
+        lines = []
+        for paragraph in text.splitlines():
+            paragraph = paragraph.rstrip()
+            line, line_width = [], 0
+            # 当前行最后一个空格的位置，英文单词放不下时从这里换行
+            last_space = -1
+            for cluster in _clusters(paragraph):
+                width = self._cluster_width(cluster)
+                if line and line_width + width > max_width and cluster not in _NO_LINE_START:
+                    if cluster.isascii() and cluster.isalnum() and last_space > 0:
+                        line, rest = line[:last_space], line[last_space + 1:]
+                    else:
+                        rest = []
+                    lines.append(line)
+                    if cluster == " ":
+                        line, line_width, last_space = [], 0, -1
+                        continue
+                    line = rest
+                    line_width = sum(w for _, w in line)
+                    last_space = -1
+                if cluster == " ":
+                    last_space = len(line)
+                line.append((cluster, width))
+                line_width += width
+            lines.append(line)
+        # 去掉首尾空行
+        while lines and not lines[0]:
+            lines.pop(0)
+        while lines and not lines[-1]:
+            lines.pop()
+        return lines
+
+    def _emoji_image(self, cluster):
+        image = self._emoji_cache.get(cluster)
+        if image is None:
+            left, top, right, bottom = self.emoji_font.getbbox(cluster, embedded_color=True)
+            image = Image.new("RGBA", (max(right - left, 1), max(bottom - top, 1)), (0, 0, 0, 0))
+            ImageDraw.Draw(image).text((-left, -top), cluster, font=self.emoji_font, embedded_color=True)
+            image = image.resize((self.font_size, self.font_size), Image.LANCZOS)
+            self._emoji_cache[cluster] = image
+        return image
+
+    def convert_text_to_image(self, text) -> bytes:
+        """将文本渲染为图片，返回图片内容"""
+        with self._lock:
+            image = self._render(text)
+        return image_codec.save(image, self.image_format, self.quality, self.optimize)
+
+    def _render(self, text):
+        lines = self._wrap(text)
+        height = 2 * self.padding + max(len(lines), 1) * self.line_height
+        image = Image.new("RGB", (self.width, height), self.background)
+        draw = ImageDraw.Draw(image)
+        # 行内文字垂直居中
+        offset = (self.line_height - self.font_size) // 2
+        for index, line in enumerate(lines):
+            x = self.padding
+            y = self.padding + index * self.line_height + offset
+            run, run_x = "", x
+            for cluster, width in line:
+                if _is_emoji(cluster) and self.emoji_font is not None:
+                    if run:
+                        draw.text((run_x, y), run, font=self.font, fill=self.color)
+                        run = ""
+                    emoji = self._emoji_image(cluster)
+                    image.paste(emoji, (int(x), y), emoji)
+                else:
+                    if not run:
+                        run_x = x
+                    run += _plain(cluster)
+                x += width
+            if run:
+                draw.text((run_x, y), run, font=self.font, fill=self.color)
+        return image
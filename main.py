@@ -1,12 +1,16 @@
 # encoding:utf-8
 
+import io
 import json
 import os, re
+import random
 import time
 import threading
+import uuid
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Tuple
 
-from apscheduler.schedulers.background import BackgroundScheduler
 
 from bot import bot_factory
 from bridge.bridge import Bridge
@@ -21,8 +25,9 @@ from common.log import logger
 from common import const
 
 from plugins.linkai.utils import Util
+from plugins.plugin_summary import (chunking, command_parser, image_codec, job_queue, llm_scheduler, metrics,
+                                    preprocess, reply_pool, session_state, summary_cache)
 from plugins.plugin_summary.db import Db
-from plugins.plugin_summary.text2img import Text2ImageConverter
 
 TRANSLATE_PROMPT = '''
 您现在是一个 Python 函数，用于将输入文本转换为相应的 JSON 格式命令，遵循以下结构：
@@ -113,8 +118,40 @@ SUMMARY_PROMPT = '''
 
 
 5. 开始给出本群讨论风格的整体评价，例如活跃、太水、太黄、太暴力、话题不集中、无聊诸如此类。
+'''
+
+# 发送聊天记录时的说明，对应 preprocess 中的格式
+CHAT_LOG_QUERY = "需要你总结的聊天记录如下([日期]之后的消息发生在该日期，同一人连续发送的消息用 / 分隔，(×N)表示相同内容出现了N次)：\n"
+
+# 分段总结时每一段的prompt
+CHUNK_SUMMARY_PROMPT = '''
+给出的是一个群聊中某一时间段的聊天记录，是完整聊天记录的一部分。请提取其中讨论的话题，稍后会与其他时间段合并成完整的群聊报告。
+你只负责总结群聊内容，不回答任何问题。不要虚构聊天记录，也不要总结不存在的信息。
+
+每个话题包含以下内容：
+
+- 话题名(50字以内)
+
+- 热度(该话题的消息数量)
+
+- 参与者(不超过5个人，将重复的人名去重)
+
+- 时间段(从几点到几点)
+
+- 过程(50-100字左右)
+
+无需整体评价，也不要输出其他内容。
+'''
 
-最后总结下今日最活跃的前五个发言者。
+# 分段总结过多时，先将若干段的话题合并的prompt
+PARTIAL_MERGE_PROMPT = '''
+给出的是同一个群聊按时间分段后各段的话题总结。请将相同或相近的话题合并：参与者合并去重(不超过5个人)，时间段取并集，热度相加，过程合并精简到100字以内。
+按原有格式输出合并后的话题，不要输出其他内容。
+'''
+
+# 合并各段总结生成最终报告的prompt
+MERGE_SUMMARY_PROMPT = SUMMARY_PROMPT + '''
+注意：给出的内容不是原始聊天记录，而是同一个群聊按时间分段后各段的话题总结。请先合并相同或相近的话题(热度按各段合计)，再按上述格式输出完整的群聊报告。
 '''
 
 # 重复总结的prompt
@@ -153,30 +190,149 @@ class Summary(Plugin):
     
     def __init__(self):
         super().__init__()
-        self._init_components()
         self._init_config()
+        self._init_components()
+        self._init_scheduler()
         self._init_handlers()
+        self._warm_up()
         
     def _init_config(self):
         """初始化配置"""
         self.config = super().load_config() or self._load_config_template()
         logger.info(f"[Summary] initialized with config={self.config}")
-        
-        # 设置定时清理任务
+
+    def _init_scheduler(self):
+        """初始化定时任务"""
+        # 设置定时清理任务和空闲时段的预先总结
         save_time = self.config.get("save_time", -1)
-        if save_time > 0:
-            self._setup_scheduler()
+        cleanup = save_time > 0 or self.config.get("session_save_time") or self.config.get("archive_after", -1) > 0
+        precompute = self.config.get("precompute", False)
+        if cleanup or precompute:
+            self._setup_scheduler(cleanup, precompute)
             
+    def _warm_up(self):
+        """在后台线程中提前准备耗时的组件，不拖慢插件加载"""
+        def run():
+            try:
+                # 打开数据库时可能要执行迁移、VACUUM和重建全文索引，不能等到第一条消息在通道线程中执行
+                self.db
+            except Exception as e:
+                logger.error(f"[Summary] failed to open database: {e}")
+            try:
+                if self.config.get("render_backend", "local") == "selenium":
+                    # 浏览器提前打开并加载好页面
+                    self._get_text2img().warm_up()
+            except Exception as e:
+                logger.error(f"[Summary] failed to warm up: {e}")
+
+        threading.Thread(target=run, name="summary-warm-up", daemon=True).start()
+
     def _init_components(self):
-        """初始化组件"""
-        self.text2img = Text2ImageConverter()
-        self.db = Db()
-        self.bot = bot_factory.create_bot(Bridge().btype['chat'])
-        
-        # 线程安全相关
-        self._summary_locks = {}
-        self._locks_lock = threading.Lock()
-        
+        """初始化组件，数据库、大模型和图片渲染在第一次使用时才创建，不拖慢插件加载"""
+        self._components = {}
+        self._components_lock = threading.RLock()
+        self.text2img = None
+        self._text2img_lock = threading.Lock()
+
+        # 大模型解析指令的结果缓存
+        self._parse_cache = command_parser.ParseCache(self.config.get("parse_cache_size", 256))
+
+        # 总结任务队列，同一会话同时只有一个总结任务
+        self.summary_jobs = job_queue.SummaryJobQueue(workers=self.config.get("summary_workers", 2),
+                                                      max_pending=self.config.get("summary_queue_size", 10))
+
+        # 指标导出，默认只在"$总结 状态"中查看
+        if metrics_file := self.config.get("metrics_file"):
+            metrics.start_file_exporter(metrics_file, self.config.get("metrics_interval", 60))
+        if metrics_port := self.config.get("metrics_port", 0):
+            try:
+                metrics.start_http_exporter(metrics_port)
+            except OSError as e:
+                logger.error(f"[Summary] failed to serve metrics on port {metrics_port}: {e}")
+
+    def _get_component(self, name: str, factory):
+        """获取组件，第一次获取时调用factory创建"""
+        if name not in self._components:
+            with self._components_lock:
+                if name not in self._components:
+                    started = time.time()
+                    self._components[name] = factory()
+                    logger.debug("[Summary] %s initialized in %.3fs", name, time.time() - started)
+        return self._components[name]
+
+    @property
+    def db(self) -> Db:
+        return self._get_component("db", lambda: Db(batch_size=self.config.get("write_batch_size", 100),
+                                                     flush_interval=self.config.get("write_flush_interval", 500),
+                                                     read_pool_size=self.config.get("read_pool_size", 2),
+                                                     archive_dir=self.config.get("archive_dir") or None))
+
+    @property
+    def bot(self):
+        return self._get_component("bot", lambda: bot_factory.create_bot(Bridge().btype['chat']))
+
+    @property
+    def llm(self) -> llm_scheduler.LLMScheduler:
+        """所有大模型请求经过调度器，限制并发并按优先级执行"""
+        return self._get_component("llm", lambda: llm_scheduler.LLMScheduler(
+            max_concurrency=self.config.get("llm_concurrency", 4), timeout=self.config.get("llm_timeout", 120),
+            retries=self.config.get("llm_retries", 2), backoff=self.config.get("llm_retry_backoff", 2)))
+
+    @property
+    def session_states(self) -> session_state.SessionStates:
+        """禁用状态、上次总结时间等会话状态缓存在内存中"""
+        return self._get_component("session_states", lambda: session_state.SessionStates(self.db))
+
+    @property
+    def summary_cache(self) -> summary_cache.SummaryCache:
+        """总结结果缓存"""
+        return self._get_component("summary_cache", lambda: summary_cache.SummaryCache(
+            ttl=self.config.get("summary_cache_ttl", 60) * 60,
+            max_bytes=self.config.get("summary_cache_size", 32) * 1024 * 1024,
+            db=self.db if self.config.get("summary_cache_persist", True) else None))
+
+    @property
+    def reply_pools(self) -> dict:
+        """预先生成的拒绝回复，拒绝请求时不再调用大模型"""
+        def create():
+            pool_size = self.config.get("reply_pool_size", 20)
+            return {
+                "in_progress": reply_pool.ReplyPool("in_progress", SUMMARY_IN_PROGRESS_PROMPT, "正在总结中，请稍后再试",
+                                                    self._generate_replies, self.db, pool_size),
+                "rate_limit": reply_pool.ReplyPool("rate_limit", REPEAT_SUMMARY_PROMPT, "地主家的驴都没我累，请让我休息一会儿",
+                                                   self._generate_replies, self.db, pool_size),
+            }
+        return self._get_component("reply_pools", create)
+
+    @property
+    def renderer(self):
+        """本地图片渲染，不可用或配置为浏览器渲染时为None"""
+        return self._get_component("renderer", self._create_renderer)
+
+    def _create_renderer(self):
+        """默认使用本地渲染，浏览器渲染作为可选的备用方案"""
+        if self.config.get("render_backend", "local") != "local":
+            return None
+        try:
+            from plugins.plugin_summary.local_render import LocalTextRenderer
+            return LocalTextRenderer(font_path=self.config.get("render_font") or None,
+                                     emoji_font_path=self.config.get("render_emoji_font") or None,
+                                     image_format=self.config.get("image_format", "png"),
+                                     quality=self.config.get("image_quality", 85),
+                                     optimize=self.config.get("image_optimize", False))
+        except Exception as e:
+            logger.warning(f"[Summary] local renderer unavailable: {e}")
+            return None
+
+    def _get_text2img(self):
+        """按需创建浏览器连接池，未安装selenium时不会导入"""
+        with self._text2img_lock:
+            if self.text2img is None:
+                from plugins.plugin_summary.text2img import Text2ImagePool
+                self.text2img = Text2ImagePool(size=self.config.get("render_pool_size", 1),
+                                               max_renders=self.config.get("render_max_uses", 50))
+            return self.text2img
+
     def _init_handlers(self):
         """初始化事件处理器"""
         self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
@@ -184,6 +340,7 @@ class Summary(Plugin):
 
     def _get_session_id(self, msg: ChatMessage) -> str:
         """获取会话ID"""
+        # itchat channel id会变动，只好用群名作为session id
         if conf().get('channel_type', 'wx') == 'wx' and msg.from_user_nickname:
             return msg.from_user_nickname
         return msg.from_user_id
@@ -216,103 +373,175 @@ class Summary(Plugin):
             return None
             
         if "开启" in content:
-            self.db.delete_summary_stop(session_id)
+            self.session_states.set_disabled(session_id, False)
             return Reply(ReplyType.TEXT, "开启成功")
             
         if "关闭" in content:
-            self.db.save_summary_stop(session_id)
+            self.session_states.set_disabled(session_id, True)
             return Reply(ReplyType.TEXT, "关闭成功")
+
+        if "任务" in content:
+            status = self.summary_jobs.status()
+            if stats := self.db.cleanup_stats:
+                status += (f"\n上次清理：删除 {stats['deleted']} 条记录，耗时 {stats['duration']}秒，"
+                           f"数据库 {stats.get('db_size', 0) / 1024 / 1024:.1f}MB")
+            if "llm" in self._components:
+                status += "\n" + self.llm.status()
+            return Reply(ReplyType.TEXT, status)
+
+        if "状态" in content:
+            return Reply(ReplyType.TEXT, metrics.REGISTRY.summary())
             
         return None
 
     def _handle_summary_command(self, content: str, session_id: str, e_context: EventContext) -> Reply:
-        """处理总结命令"""
-        # 检查锁
-        if not self._acquire_summary_lock(session_id):
-            return self._get_in_progress_reply(session_id, content)
-            
+        """处理总结命令：提交后台任务后立即返回，总结结果由后台任务发送"""
+        # 命中缓存不消耗大模型，在频率限制之前检查；只用本地解析，需要大模型解析的指令在后台任务中处理
+        args = None
+        if not self.session_states.is_disabled(session_id):
+            args = self._parse_summary_args(content, use_llm=False)
+            if args is not None and (cached := self._get_cached_summary(session_id, *args)):
+                return cached
+
+        # 检查限制
+        if error_reply := self._check_summary_limits(session_id):
+            return error_reply
+        if not self.session_states.begin(session_id):
+            return self._get_in_progress_reply()
+
+        channel, context = e_context["channel"], e_context["context"]
+        result = self.summary_jobs.submit(session_id,
+                                          lambda: self._run_summary_job(content, session_id, channel, context, args))
+        if result != job_queue.ACCEPTED:
+            self.session_states.finish(session_id)
+        if result == job_queue.DUPLICATE:
+            return self._get_in_progress_reply()
+        if result == job_queue.REJECTED:
+            logger.warning(f"[Summary] summary queue is full, reject {session_id}")
+            return Reply(ReplyType.TEXT, "当前总结任务太多，请稍后再试")
+        return Reply(ReplyType.TEXT, "正在加速生成总结，请稍等")
+
+    def _run_summary_job(self, content: str, session_id: str, channel, context, args: tuple = None):
+        """在后台线程中解析指令、生成总结并发送
+
+        :param args: 已经解析好的命令参数，为空时在这里解析
+        """
         try:
-            # 检查限制
-            if error_reply := self._check_summary_limits(session_id):
-                return error_reply
-            
-            # 添加回复
-            _send_info(e_context, "正在加速生成总结，请稍等")
             # 解析命令参数
-            limit, duration, username = self._parse_summary_args(content)
-            
+            limit, duration, username, keyword = args or self._parse_summary_args(content)
+
             # 生成总结
-            start_time = int(time.time()) - duration if duration > 0 else 0
-            return self._generate_summary(session_id,start_time= start_time,limit= limit ,username=username)
-            
+            start_time = self._get_start_time(session_id, limit, duration, username, keyword)
+            reply = self._generate_summary(session_id, start_time=start_time, limit=limit, username=username,
+                                           keyword=keyword)
         except Exception as e:
             logger.error(f"[Summary] Error handling summary command: {e}")
-            return Reply(ReplyType.TEXT, "处理总结命令时发生错误")
+            reply = Reply(ReplyType.TEXT, "处理总结命令时发生错误")
         finally:
-            self._release_summary_lock(session_id)
+            self.session_states.finish(session_id)
+        channel.send(reply, context)
+
+    def _get_start_time(self, session_id: str, limit: int, duration: int, username: list, keyword: str) -> int:
+        """总结的起始时间，0表示不限"""
+        start_time = int(time.time()) - duration if duration > 0 else 0
+        if not start_time and not limit and not username and not keyword:
+            start_time = self._get_precomputed_start(session_id) or 0
+        return start_time
+
+    def _get_cached_summary(self, session_id: str, limit: int, duration: int, username: list,
+                            keyword: str) -> Optional[Reply]:
+        """相同范围且没有新消息时返回缓存的总结，未命中返回None"""
+        try:
+            start_time = self._get_start_time(session_id, limit, duration, username, keyword)
+            cache_key = summary_cache.make_key(session_id, start_time, limit, username,
+                                               self.db.get_last_record(session_id), keyword)
+            cached = self.summary_cache.get(cache_key)
+        except Exception as e:
+            logger.error(f"[Summary] failed to check summary cache: {e}")
+            return None
+        if cached is None:
+            return None
+        logger.info("[Summary] summary cache hit before rate limit: %s", session_id)
+        metrics.inc("summary_cache_total", result="hit")
+        return self._build_summary_reply(*cached)
 
     def _check_summary_limits(self, session_id: str) -> Optional[Reply]:
         """检查总结"""
-        if session_id in self.db.disable_group:
+        state = self.session_states.get(session_id)
+        if state.disabled:
             return Reply(ReplyType.TEXT, "请联系管理员开启总结功能")
+        if state.in_flight is not None:
+            return self._get_in_progress_reply()
             
         limit_time = self.config.get("rate_limit_summary", 60) * 60
-        last_time = self.db.get_summary_time(session_id)
-        
-        if last_time and time.time() - last_time < limit_time:
-            return self._get_rate_limit_reply(session_id)
+        if state.summary_time and time.time() - state.summary_time < limit_time:
+            return self._get_rate_limit_reply()
             
         return None
 
-    def _parse_summary_args(self, content: str) -> Tuple[int, int, str]:
+    def _parse_summary_args(self, content: str,
+                            use_llm: bool = True) -> Optional[Tuple[int, int, list, Optional[str]]]:
         """解析总结参数
         
         Args:
-            content: 用户输入的命令内容，例如"@妮可 @欧尼 3小时内的前99条消息"
+            content: 用户输入的命令内容，例如"@妮可 @欧尼 3小时内的前99条消息"、"关键词:世界杯 今天"
+            use_llm: 本地无法解析时是否交给大模型解析，为False时无法解析返回None
             
         Returns:
-            Tuple[int, int, str]: 返回(消息数量限制, 时间范围(秒), 用户名列表)的���组
-            如果解析失败返回(None, None, None)
+            Tuple[int, int, list, Optional[str]]: 返回(消息数量限制, 时间范围(秒), 用户名列表, 关键词)的元组
+            解析失败时按默认参数总结
         """
+        # 先提取关键词和所有@用户名
+        content, keyword = command_parser.extract_keyword(content)
+        usernames = []
+        cleaned_content = []
+        for part in content.split():
+            if part.startswith('@'):
+                usernames.append(part.lstrip('@'))
+            else:
+                cleaned_content.append(part)
+        text = ''.join(cleaned_content).replace(self.TRIGGER_PREFIX + "总结", "", 1)
+
+        # 优先本地解析，无法确定时再交给大模型，大模型的结果按指令缓存
+        path = "local"
+        parsed = command_parser.parse(text)
+        if parsed is None:
+            key = command_parser.normalize(text)
+            path = "cache"
+            parsed = self._parse_cache.get(key)
+            if parsed is None:
+                if not use_llm:
+                    return None
+                path = "llm"
+                parsed = self._parse_with_llm(text)
+                if parsed is not None:
+                    self._parse_cache.put(key, parsed)
+        if parsed is None:
+            path = "failed"
+            parsed = (None, None)
+        metrics.inc("summary_parse_total", path=path)
+
+        limit, duration = parsed
+        duration = max(int(duration or 0), 0) or self.DEFAULT_DURATION
+        logger.debug("[Summary] Parsed args via %s: limit=%s, duration=%s, users=%s, keyword=%s",
+                     path, limit, duration, usernames, keyword)
+        return limit, duration, usernames, keyword
+
+    def _parse_with_llm(self, text: str) -> Optional[Tuple[Optional[int], Optional[int]]]:
+        """由大模型将指令翻译为(消息数量, 时长(秒))，失败返回None"""
         try:
-            # 先提取所有@用户名
-            usernames = []
-            parts = content.split()
-            cleaned_content = []
-            
-            for part in parts:
-                if part.startswith('@'):
-                    usernames.append(part.lstrip('@'))
-                else:
-                    cleaned_content.append(part)
-                    
-            content = ''.join(cleaned_content)
-            print(f"[Summary] username: {len(usernames)}")
-            # 将中文内容转换为标准命令格式
-            command_json = find_json(self._translate_text_to_commands(content))
-            command = json.loads(command_json)
-            
-            if command["name"].lower() == "summary":
-                args = command["args"]
-                limit = int(args.get("count", None))
-                # 获取消息数量限制
-                # limit = max(int(args.get("count", self.DEFAULT_LIMIT)), 0)
-                
-                # 获取时间范围(秒)
-                duration = args.get("duration_in_seconds", self.DEFAULT_DURATION)
-                if isinstance(duration, str):
-                    # 处理可能的时间字符串
-                    duration = int(float(duration))
-                duration = max(int(duration), 0) or self.DEFAULT_DURATION
-                
-                logger.debug(f"[Summary] Parsed args: limit={limit}, duration={duration}, users={usernames}")
-                return limit, duration, usernames
-                
+            command = json.loads(find_json(self._translate_text_to_commands(text)))
+            if command["name"].lower() != "summary":
+                # 无操作时按默认参数总结
+                return None, None
+            args = command["args"]
+            count = args.get("count")
+            duration = args.get("duration_in_seconds")
+            return (int(count) if count else None), (int(float(duration)) if duration else None)
         except Exception as e:
             logger.error(f"[Summary] Failed to parse command: {e}")
-            logger.debug(f"[Summary] Original content: {content}")
-            
-        return None, None, None
+            logger.debug("[Summary] Original content: %s", text)
+            return None
 
     def _load_config_template(self):
         logger.debug("No summary plugin config.json, use plugins/linkai/config.json.template")
@@ -325,43 +554,136 @@ class Summary(Plugin):
         except Exception as e:
             logger.exception(e)
 
-    def _setup_scheduler(self):
+    def _setup_scheduler(self, cleanup: bool = True, precompute: bool = False):
+        from apscheduler.schedulers.background import BackgroundScheduler
+
         # 创建调度器
         self.scheduler = BackgroundScheduler()
 
         # 清理旧记录的函数
         def clean_old_records():
-            # 配置文件单位分钟，转换为秒
-            save_time = self.config.get("save_time", 12 * 60) * 60
-            self.db.delete_records(int(time.time()) - save_time)
-
-        # 设置定时任务，每天凌晨12点执行
-        self.scheduler.add_job(clean_old_records, 'cron', hour=00, minute=00)
+            # 配置文件单位分钟，转换为秒，-1为永久保存
+            now = int(time.time())
+            archive_after = self.config.get("archive_after", -1)
+            if archive_after > 0:
+                self.db.archive_records(now - archive_after * 60, batch_size=self.config.get("clean_batch_size", 2000))
+            save_time = self.config.get("save_time", 12 * 60)
+            session_before = {session_id: now - minutes * 60 if minutes > 0 else None
+                              for session_id, minutes in (self.config.get("session_save_time") or {}).items()}
+            self.db.purge_records(now - save_time * 60 if save_time > 0 else None, session_before,
+                                  batch_size=self.config.get("clean_batch_size", 2000))
+
+        if cleanup:
+            # 设置定时任务，每隔一段时间分批清理，启动时先在后台执行一次
+            interval = max(int(self.config.get("clean_interval", 10)), 1)
+            self.scheduler.add_job(clean_old_records, 'interval', minutes=interval, next_run_time=datetime.now(),
+                                   max_instances=1, coalesce=True)
+            logger.info(f"[Summary] cleaning old records every {interval} minutes")
+        if precompute:
+            # 每天空闲时段开始时安排各会话的预先总结
+            start, _ = self._precompute_window()
+            self.scheduler.add_job(self._plan_precompute, 'cron', hour=start // 60, minute=start % 60,
+                                   max_instances=1, coalesce=True)
+            logger.info("[Summary] precompute summaries daily at %02d:%02d", start // 60, start % 60)
         # 启动调度器
         self.scheduler.start()
-        clean_old_records()
-        logger.info("Scheduler started. Cleaning old records every day at midnight.")
+
+    def _precompute_window(self) -> Tuple[int, int]:
+        """空闲时段，返回(开始时间距零点的分钟数, 时段长度(秒))，结束早于开始时表示跨过零点"""
+        try:
+            start, end = [int(part.split(":")[0]) * 60 + int(part.split(":")[1])
+                          for part in self.config.get("precompute_window", "03:00-06:00").split("-")]
+        except (ValueError, IndexError):
+            logger.warning("[Summary] invalid precompute_window, use 03:00-06:00")
+            start, end = 180, 360
+        return start, ((end - start) % 1440 or 1440) * 60
+
+    def _plan_precompute(self):
+        """空闲时段开始时为近期活跃的会话安排预先总结，各会话在时段内错开执行"""
+        _, window = self._precompute_window()
+        since = int(time.time()) - self.config.get("precompute_duration", 1440) * 60
+        sessions = [session_id for session_id in
+                    self.db.get_active_sessions(since, max(self.config.get("precompute_min_records", 20), 2))
+                    if not self.session_states.is_disabled(session_id)]
+        if not sessions:
+            return
+        # 只使用时段的前90%，最后一个会话也能在时段内完成
+        spacing = window * 0.9 / len(sessions)
+        now = time.time()
+        for index, session_id in enumerate(sessions):
+            run_at = now + index * spacing + random.uniform(0, spacing / 2)
+            self.scheduler.add_job(self._precompute_summary, 'date', run_date=datetime.fromtimestamp(run_at),
+                                   args=[session_id], misfire_grace_time=int(spacing) + 60)
+        logger.info("[Summary] scheduled precompute for %d sessions, every %.0fs", len(sessions), spacing)
+
+    def _precompute_summary(self, session_id: str):
+        """预先总结会话近期的聊天记录：替换滚动总结并缓存文本和图片，不记录总结时间，不影响频率限制"""
+        if self.session_states.is_disabled(session_id) or not self.session_states.begin(session_id):
+            return
+        started = time.time()
+        try:
+            start_time = int(started) - self.config.get("precompute_duration", 1440) * 60
+            last_record = self.db.get_last_record(session_id)
+            chat_logs, count, window_start, newest = self._load_chat_logs(session_id, start_timestamp=start_time)
+            if count < 2 or not chat_logs:
+                return
+            content = self._summarize_lines(session_id, chat_logs, llm_scheduler.PRIORITY_BACKGROUND)
+            if not content:
+                logger.warning("[Summary] precompute summary for %s failed", session_id)
+                metrics.inc("summary_precompute_total", result="failed")
+                return
+            self.db.save_digest(session_id, content, window_start, *newest)
+            if self.config.get("summary_stats", True):
+                content += self._format_stats(session_id, window_start, newest[0])
+            image = None
+            try:
+                image = self.convert_text_to_image(content)
+            except Exception as e:
+                logger.error("[Summary] Failed to convert text to image: %s", str(e))
+            # 与不带参数的总结指令使用相同的缓存key，见 _get_precomputed_start；保留到下一次预先总结完成
+            _, window = self._precompute_window()
+            self.summary_cache.put(summary_cache.make_key(session_id, window_start, None, None, last_record),
+                                   session_id, content, image, ttl=86400 + window)
+            metrics.inc("summary_precompute_total", result="completed")
+            logger.info("[Summary] precomputed summary for %s with %d records in %.1fs", session_id, count,
+                        time.time() - started)
+        except Exception as e:
+            metrics.inc("summary_precompute_total", result="failed")
+            logger.error(f"[Summary] precompute summary for {session_id} failed: {e}")
+        finally:
+            metrics.observe("summary_precompute_seconds", time.time() - started)
+            self.session_states.finish(session_id)
+
+    def _get_precomputed_start(self, session_id: str) -> Optional[int]:
+        """开启预先总结时，不带参数的总结从最近一次预先总结的范围开始，只需合并之后的新消息"""
+        if not self.config.get("precompute", False):
+            return None
+        digest = self.db.get_digest(session_id)
+        # 太久没有预先总结(例如会话一直不活跃)时按原来的范围总结
+        if digest is None or digest[1] < time.time() - 2 * self.config.get("precompute_duration", 1440) * 60:
+            return None
+        return digest[1]
 
     def on_receive_message(self, e_context: EventContext):
 
         if e_context['context'].type != ContextType.TEXT:
             return
+        started = time.perf_counter()
         context = e_context['context']
         cmsg: ChatMessage = e_context['context']['msg']
         
-        session_id = cmsg.from_user_id
-        if session_id in self.db.disable_group:
-            logger.info("[Summary] group %s is disabled" % session_id)
+        # 与总结指令使用相同的会话id，否则禁用状态对不上
+        session_id = self._get_session_id(cmsg)
+        if self.session_states.is_disabled(session_id):
+            logger.debug("[Summary] group %s is disabled", session_id)
             return
         
-        if "{trigger_prefix}总结" in context.content:
-            logger.debug("[Summary] 指令不保存: %s" % context.content)
+        # 总结指令不是聊天内容，保存后会成为会话最新的记录，使总结缓存失效并被计入总结和统计
+        if self.TRIGGER_PREFIX + "总结" in context.content:
+            logger.debug("[Summary] 指令不保存: %s", context.content)
             return
         
         username = None
- 
-        if conf().get('channel_type', 'wx') == 'wx' and cmsg.from_user_nickname is not None:
-            session_id = cmsg.from_user_nickname  # itchat channel id会变动，只好用群名作为session id
 
         if context.get("isgroup", False):
             username = cmsg.actual_user_nickname
@@ -386,79 +708,267 @@ class Summary(Plugin):
             match_prefix = check_prefix(content, conf().get('single_chat_prefix', ['']))
             if match_prefix is not None:
                 is_triggered = True
-        logger.debug("[Summary] save record: %s" % context.content)
+        logger.debug("[Summary] save record: %s", context.content)
         self.db.insert_record(session_id, cmsg.msg_id, username, context.content, str(context.type), cmsg.create_time,
                               int(is_triggered))
+        metrics.observe("summary_ingest_seconds", time.perf_counter() - started)
 
-    def _acquire_summary_lock(self, session_id: str) -> bool:
-        """
-        尝试获取指定会话的总结锁
-        返回是否成功获取锁
-        """
-        with self._locks_lock:
-            if session_id in self._summary_locks:
-                # 如果锁已存在，说明正在进行总结
-                return False
-            self._summary_locks[session_id] = time.time()
-            return True
-
-    def _release_summary_lock(self, session_id: str):
-        """释放指定会话的总结锁"""
-        with self._locks_lock:
-            self._summary_locks.pop(session_id, None)
-
-    def _generate_summary(self, session_id: str, start_time: int = None, limit: int = None, username: list = None) -> Reply:
+    def _generate_summary(self, session_id: str, start_time: int = None, limit: int = None, username: list = None,
+                          keyword: str = None) -> Reply:
         """生成聊天记录总结"""
         try:
-            records = self.db.get_records(session_id, start_timestamp=start_time, limit=limit, username=username)
-
-            # 检查记录数量
-            if not records:
-                return Reply(ReplyType.TEXT, "未找到相关聊天记录")
-            if len(records) == 1:
-                return Reply(ReplyType.TEXT, "聊天记录太少，无法生成有意义的总结")
-
-            # 构建聊天记录文本
-            chat_logs = []
-            for record in records:
-                chat_logs.append(f"{record[2]}({record[7]}): {record[3]}")
-            chat_text = "\n".join(chat_logs)
-            
-            logger.debug("[Summary] Processing %d chat records for summary", len(records))
-
-            # 生成总结
-            session = self.bot.sessions.build_session(session_id, SUMMARY_PROMPT)
-            session.add_query(f"需要你总结的聊天记录如下：{chat_text}")
-            result = self.bot.reply_text(session)
-            
-            total_tokens, completion_tokens, reply_content = (
-                result['total_tokens'],
-                result['completion_tokens'],
-                result['content']
-            )
-            logger.debug("[Summary] tokens(total=%d, completion=%d)", total_tokens, completion_tokens)
-
-            if completion_tokens == 0:
+            # 相同范围的总结在没有新消息时直接使用缓存
+            cache_key = summary_cache.make_key(session_id, start_time, limit, username,
+                                               self.db.get_last_record(session_id), keyword)
+            if cached := self.summary_cache.get(cache_key):
+                logger.info("[Summary] summary cache hit: %s", session_id)
+                metrics.inc("summary_cache_total", result="hit")
+                return self._build_summary_reply(*cached)
+            metrics.inc("summary_cache_total", result="miss")
+
+            # 未限制数量、用户和关键词时使用滚动总结，只总结上次总结之后的新消息
+            incremental = (self.config.get("incremental_summary", True)
+                           and not limit and not username and not keyword)
+            digest = self._get_usable_digest(session_id, start_time) if incremental else None
+            if digest:
+                digest_content, window_start, digest_end, digest_msgid = digest
+                # 从滚动总结的最后一条记录之后开始读取，包含同一秒内后来的消息
+                chat_logs, count, _, newest = self._load_chat_logs(session_id, start_timestamp=digest_end,
+                                                                   after_msgid=digest_msgid)
+                logger.debug("[Summary] Incremental summary with %d new records", count)
+                reply_content = self._merge_digest(session_id, digest_content, chat_logs)
+                window_end = newest[0] if newest else digest_end
+            else:
+                chat_logs, count, window_start, newest = self._load_chat_logs(
+                    session_id, start_timestamp=start_time, limit=limit, username=username, keyword=keyword)
+
+                # 检查记录数量
+                if not count:
+                    return Reply(ReplyType.TEXT, "未找到相关聊天记录")
+                if count == 1 or not chat_logs:
+                    return Reply(ReplyType.TEXT, "聊天记录太少，无法生成有意义的总结")
+                logger.debug("[Summary] Processing %d chat records for summary", count)
+
+                # 生成总结
+                reply_content = self._summarize_lines(session_id, chat_logs)
+                window_end = newest[0]
+
+            if not reply_content:
                 return Reply(ReplyType.TEXT, "生成总结失败，请稍后重试")
 
+            if digest:
+                if newest:
+                    self.db.save_digest(session_id, reply_content, window_start, *newest)
+            elif incremental:
+                # 不用范围更小的总结覆盖已有的滚动总结
+                stored = self.db.get_digest(session_id)
+                if stored is None or window_start <= stored[1]:
+                    self.db.save_digest(session_id, reply_content, window_start, *newest)
+
             # 记录本次总结时间
-            self.db.save_summary_time(session_id, int(time.time()))
+            self.session_states.set_summary_time(session_id, int(time.time()))
+
+            # 发言统计由数据库直接计算，附在总结之后，不放入滚动总结；@用户总结时只统计这些用户
+            if self.config.get("summary_stats", True) and not keyword:
+                reply_content += self._format_stats(session_id, window_start, window_end, username)
 
             # 转换为图片
+            image = None
             try:
-                image_path = self.convert_text_to_image(reply_content)
-                reply = Reply(ReplyType.IMAGE, open(image_path, 'rb'))
-                os.remove(image_path)
-                return reply
+                image = self.convert_text_to_image(reply_content)
             except Exception as e:
                 logger.error("[Summary] Failed to convert text to image: %s", str(e))
-                # 如果图片转换失败，返回文本
-                return Reply(ReplyType.TEXT, reply_content)
+            self.summary_cache.put(cache_key, session_id, reply_content, image)
+            return self._build_summary_reply(reply_content, image)
 
         except Exception as e:
             logger.error("[Summary] Error generating summary: %s", str(e))
             return Reply(ReplyType.TEXT, "生成总结时发生错误，请稍后重试")
 
+    def _format_stats(self, session_id: str, start_time: int, end_time: int, username: list = None) -> str:
+        """总结范围内的发言人数、最活跃的发言者和各时段的消息数，包含归档的记录"""
+        try:
+            speaker_count, top_speakers = self.db.get_speaker_stats(session_id, start_time, end_time,
+                                                                    username=username)
+            hourly = self.db.get_hourly_activity(session_id, start_time, end_time, username=username)
+        except Exception as e:
+            logger.error("[Summary] Failed to get speaker stats: %s", str(e))
+            return ""
+        if not hourly:
+            return ""
+        lines = ["", "------------", f"共 {sum(count for _, count in hourly)} 条消息，{speaker_count} 人发言", "",
+                 "最活跃的发言者："]
+        lines += [f"{index + 1}. {name}：{count} 条" for index, (name, count) in enumerate(top_speakers)]
+        lines += ["", "各时段消息数："]
+        # 每行四个时段
+        periods = [f"{hour:02d}时 {count}条" for hour, count in hourly]
+        lines += ["  ".join(periods[i:i + 4]) for i in range(0, len(periods), 4)]
+        return "\n".join(lines)
+
+    @staticmethod
+    def _build_summary_reply(content: str, image: Optional[bytes]) -> Reply:
+        """有图片时回复图片，图片转换失败时回复文本"""
+        if image:
+            return Reply(ReplyType.IMAGE, io.BytesIO(image))
+        return Reply(ReplyType.TEXT, content)
+
+    def _ask_bot(self, session_id: str, system_prompt: str, query: str,
+                 priority: int = llm_scheduler.PRIORITY_SUMMARY) -> Tuple[str, int, int]:
+        """发起一次独立的大模型会话，返回(回复内容, 总token数, 生成token数)，失败时生成token数为0
+
+        请求经过调度器排队，出错或没有生成内容时会重试；同一会话的分段请求(session_id#...)轮流排队
+        """
+        def ask():
+            session = self.bot.sessions.build_session(session_id, system_prompt)
+            session.add_query(query)
+            try:
+                result = self.bot.reply_text(session)
+            finally:
+                self.bot.sessions.clear_session(session_id)
+            if not result.get('completion_tokens'):
+                raise RuntimeError(result.get('content') or "empty reply")
+            metrics.inc("summary_llm_tokens_total", result['total_tokens'] - result['completion_tokens'],
+                        kind="prompt")
+            metrics.inc("summary_llm_tokens_total", result['completion_tokens'], kind="completion")
+            return result['content'], result['total_tokens'], result['completion_tokens']
+
+        try:
+            return self.llm.call(ask, priority, session_id.split("#", 1)[0])
+        except Exception as e:
+            logger.error("[Summary] llm request for %s failed: %s", session_id, e)
+            return str(e), 0, 0
+
+    def _generate_replies(self, session_id: str, system_prompt: str, query: str) -> str:
+        """批量生成拒绝回复，使用独立的会话避免影响群聊的会话"""
+        content, total_tokens, completion_tokens = self._ask_bot(session_id, system_prompt, query,
+                                                                 llm_scheduler.PRIORITY_BACKGROUND)
+        logger.debug("[Summary] generate replies total_tokens: %d, completion_tokens: %d",
+                     total_tokens, completion_tokens)
+        return content if completion_tokens else ""
+
+    def _get_usable_digest(self, session_id: str, start_time: int) -> Optional[tuple]:
+        """获取能覆盖本次总结范围的滚动总结：总结范围内、滚动总结开始之前没有其他聊天记录"""
+        digest = self.db.get_digest(session_id)
+        if not digest:
+            return None
+        digest_start = digest[1]
+        if digest_start < (start_time or 0):
+            # 滚动总结包含了本次范围之外的更早的记录
+            return None
+        if self.db.has_records(session_id, start_time, digest_start):
+            return None
+        return digest
+
+    def _load_chat_logs(self, session_id: str, start_timestamp: int = None, limit: int = None,
+                        username: list = None, keyword: str = None,
+                        after_msgid: int = None) -> Tuple[list, int, Optional[int], Optional[tuple]]:
+        """从新到旧流式读取并预处理聊天记录，超过 summary_max_tokens 后不再读取更早的记录
+
+        Returns:
+            (按时间升序的聊天记录文本, 读取的记录数, 最早一条的时间, 最新一条的(时间, 消息id))，没有记录时后两项为None
+        """
+        started = time.perf_counter()
+        budget = self.config.get("summary_max_tokens", 100000)
+        preprocessor = preprocess.ChatPreprocessor(
+            dedup=self.config.get("preprocess_dedup", True),
+            collapse=self.config.get("preprocess_collapse", True),
+            relative_time=self.config.get("preprocess_relative_time", True),
+            max_length=self.config.get("preprocess_max_length", 300),
+            drop_empty=self.config.get("preprocess_drop_empty", True))
+        count, oldest, newest = 0, None, None
+        records = self.db.iter_records(session_id, start_timestamp=start_timestamp, limit=limit, username=username,
+                                       keyword=keyword, context=self.config.get("keyword_context", 2),
+                                       after_msgid=after_msgid)
+        try:
+            for msgid, user, content, timestamp in records:
+                if count and preprocessor.tokens >= budget:
+                    logger.info("[Summary] %s reached token budget %d, older records are skipped", session_id, budget)
+                    break
+                preprocessor.feed(user, content, timestamp)
+                count += 1
+                oldest = timestamp
+                if newest is None:
+                    newest = (timestamp, msgid)
+        finally:
+            records.close()
+        chat_logs = preprocessor.lines()
+        tokens = sum(chunking.estimate_tokens(line) + 1 for line in chat_logs)
+        logger.info("[Summary] preprocessed %d records: tokens %d -> %d, saved %d, %s", count,
+                    preprocessor.raw_tokens, tokens, preprocessor.raw_tokens - tokens, preprocessor.stats)
+        # 读取和预处理的总耗时，其中数据库查询的耗时单独记录在 db_query_seconds
+        metrics.observe("summary_load_seconds", time.perf_counter() - started)
+        metrics.observe("summary_load_records", count, buckets=metrics.COUNT_BUCKETS)
+        metrics.observe("summary_prompt_tokens", tokens, buckets=metrics.COUNT_BUCKETS)
+        return chat_logs, count, oldest, newest
+
+    def _merge_digest(self, session_id: str, digest: str, chat_logs: list) -> Optional[str]:
+        """将新消息的总结合并到已有的滚动总结中，失败返回None"""
+        if not chat_logs:
+            return digest
+        max_tokens = self.config.get("chunk_max_tokens", 8000)
+        partials = self._map_chunks(session_id, chunking.split_chunks(chat_logs, max_tokens))
+        if partials is None:
+            return None
+        return self._reduce_summaries(session_id, [digest] + partials, max_tokens)
+
+    def _summarize_lines(self, session_id: str, lines: list, priority: int = llm_scheduler.PRIORITY_SUMMARY) -> Optional[str]:
+        """总结聊天记录，失败返回None
+
+        聊天记录超过 chunk_max_tokens 时按时间分段，各段并行总结后再合并为最终报告
+        """
+        max_tokens = self.config.get("chunk_max_tokens", 8000)
+        chunks = chunking.split_chunks(lines, max_tokens)
+        if len(chunks) == 1:
+            content, total_tokens, completion_tokens = self._ask_bot(
+                session_id, SUMMARY_PROMPT, CHAT_LOG_QUERY + "\n".join(chunks[0]), priority)
+            logger.info("[Summary] summary tokens(total=%d, completion=%d)", total_tokens, completion_tokens)
+            return content if completion_tokens else None
+
+        partials = self._map_chunks(session_id, chunks, priority)
+        if partials is None:
+            return None
+        return self._reduce_summaries(session_id, partials, max_tokens, priority)
+
+    def _map_chunks(self, session_id: str, chunks: list, priority: int = llm_scheduler.PRIORITY_SUMMARY) -> Optional[list]:
+        """并行总结各段聊天记录，返回各段的话题总结，失败返回None"""
+        def summarize_chunk(item):
+            index, chunk = item
+            return self._ask_bot(f"{session_id}#chunk{index}", CHUNK_SUMMARY_PROMPT,
+                                 CHAT_LOG_QUERY + "\n".join(chunk), priority)
+
+        workers = max(1, min(self.config.get("summary_concurrency", 4), len(chunks)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="summary-map") as executor:
+            results = list(executor.map(summarize_chunk, enumerate(chunks)))
+        logger.info("[Summary] map stage: chunks=%d, tokens(total=%d, completion=%d)", len(chunks),
+                    sum(r[1] for r in results), sum(r[2] for r in results))
+        if any(completion_tokens == 0 for _, _, completion_tokens in results):
+            return None
+        return [content for content, _, _ in results]
+
+    def _reduce_summaries(self, session_id: str, partials: list, max_tokens: int,
+                          priority: int = llm_scheduler.PRIORITY_SUMMARY) -> Optional[str]:
+        """将各段总结合并为最终报告，合并的输入超过预算时先分组合并"""
+        while True:
+            sections = [f"第{index + 1}段：\n{partial}" for index, partial in enumerate(partials)]
+            groups = chunking.split_chunks(sections, max_tokens)
+            if len(groups) == 1 or len(groups) >= len(partials):
+                break
+            merged = []
+            for index, group in enumerate(groups):
+                content, total_tokens, completion_tokens = self._ask_bot(
+                    f"{session_id}#merge{index}", PARTIAL_MERGE_PROMPT, "\n\n".join(group), priority)
+                logger.info("[Summary] partial merge tokens(total=%d, completion=%d)", total_tokens, completion_tokens)
+                if completion_tokens == 0:
+                    return None
+                merged.append(content)
+            partials = merged
+
+        content, total_tokens, completion_tokens = self._ask_bot(
+            session_id, MERGE_SUMMARY_PROMPT, "需要你合并的分段总结如下：\n\n" + "\n\n".join(sections),
+            priority)
+        logger.info("[Summary] reduce stage tokens(total=%d, completion=%d)", total_tokens, completion_tokens)
+        return content if completion_tokens else None
+
     def on_handle_context(self, e_context: EventContext):
         """处理上下文事件"""
         if e_context['context'].type != ContextType.TEXT:
@@ -482,13 +992,10 @@ class Summary(Plugin):
     def _translate_text_to_commands(self, text):
         # 随机的session id
         session_id = str(time.time())
-        session = self.bot.sessions.build_session(session_id, system_prompt=TRANSLATE_PROMPT)
-        session.add_query(text)
-        result = self.bot.reply_text(session)
-        total_tokens, completion_tokens, reply_content = result['total_tokens'], result['completion_tokens'], \
-                result['content']
-        logger.debug("[Summary] total_tokens: %d, completion_tokens: %d, reply_content: %s" % (
-                total_tokens, completion_tokens, reply_content))
+        reply_content, total_tokens, completion_tokens = self._ask_bot(session_id, TRANSLATE_PROMPT, text,
+                                                                           llm_scheduler.PRIORITY_COMMAND)
+        logger.debug("[Summary] total_tokens: %d, completion_tokens: %d, reply_content: %s",
+                     total_tokens, completion_tokens, reply_content)
         if completion_tokens == 0:
             logger.error("[Summary] translate failed")
             return ""
@@ -500,69 +1007,48 @@ class Summary(Plugin):
         if not verbose:
             return help_text
         trigger_prefix = conf().get('plugin_trigger_prefix', "$")
-        help_text += f"使用方法:输入\"{trigger_prefix}总结 最近消息数量\"，我会帮助你总结聊天记录。\n例如：\"{trigger_prefix}总结 100\"，我会总结最近100条消息。\n\n你也可以直接输入\"{trigger_prefix}总结前99条信息\"或\"{trigger_prefix}总结3小时内的最近10条消息\"\n我会尽可能理解你的指令。"
+        help_text += f"使用方法:输入\"{trigger_prefix}总结 最近消息数量\"，我会帮助你总结聊天记录。\n例如：\"{trigger_prefix}总结 100\"，我会总结最近100条消息。\n\n你也可以直接输入\"{trigger_prefix}总结前99条信息\"或\"{trigger_prefix}总结3小时内的最近10条消息\"\n我会尽可能理解你的指令。\n\n输入\"{trigger_prefix}总结 关键词:xxx\"只总结和xxx有关的消息。"
         return help_text
 
-    def convert_text_to_image(self, text):
-        converter = Text2ImageConverter()
-        converter.setup_driver()
-        image_path = converter.convert_text_to_image(text)
-        converter.close()
-        return image_path
-
-    def _get_in_progress_reply(self, session_id: str, content: str) -> Reply:
-        """获取正在处理中的回复"""
+    def convert_text_to_image(self, text) -> bytes:
+        """将总结文本转换为图片，返回图片内容，全程在内存中完成"""
+        image = None
+        if self.renderer is not None:
+            try:
+                with metrics.timer("summary_render_seconds", backend="local"):
+                    image = self.renderer.convert_text_to_image(text)
+            except Exception as e:
+                if not self.config.get("render_fallback", True):
+                    raise
+                logger.error(f"[Summary] local render failed, fallback to selenium: {e}")
+        if image is None:
+            with metrics.timer("summary_render_seconds", backend="selenium"):
+                image = image_codec.encode(self._get_text2img().convert_text_to_image(text),
+                                           self.config.get("image_format", "png"),
+                                           self.config.get("image_quality", 85),
+                                           self.config.get("image_optimize", False))
+        metrics.observe("summary_image_bytes", len(image), buckets=(10240, 102400, 512000, 1048576, 5242880))
+        if debug_dir := self.config.get("image_debug_dir"):
+            self._dump_image(debug_dir, image)
+        return image
+
+    def _dump_image(self, debug_dir: str, image: bytes):
+        """调试用：将生成的图片保存到文件"""
         try:
-            session = self.bot.sessions.build_session(session_id, SUMMARY_IN_PROGRESS_PROMPT)
-            session.add_query(f"问题：{content}")
-            result = self.bot.reply_text(session)
-            
-            total_tokens, completion_tokens, reply_content = (
-                result['total_tokens'],
-                result['completion_tokens'],
-                result['content']
-            )
-            
-            logger.debug(
-                "[Summary] total_tokens: %d, completion_tokens: %d, reply_content: %s",
-                total_tokens, completion_tokens, reply_content
-            )
-            
-            if completion_tokens == 0:
-                return Reply(ReplyType.TEXT, "正在总结中，请稍后再试")
-            return Reply(ReplyType.TEXT, reply_content)
-            
+            os.makedirs(debug_dir, exist_ok=True)
+            path = os.path.join(debug_dir, "summary_{}_{}.{}".format(
+                time.strftime("%Y%m%d_%H%M%S"), uuid.uuid4().hex[:8],
+                image_codec.extension(self.config.get("image_format", "png"))))
+            with open(path, "wb") as f:
+                f.write(image)
+            logger.debug("[Summary] image dumped to %s", path)
         except Exception as e:
-            logger.error(f"[Summary] Failed to get in progress reply: {e}")
-            return Reply(ReplyType.TEXT, "正在总结中，请稍后再试")
+            logger.error(f"[Summary] failed to dump image: {e}")
 
-    def _get_rate_limit_reply(self, session_id: str) -> Reply:
-        """获取频率限制的回复"""
-        try:
-            session = self.bot.sessions.build_session(session_id, REPEAT_SUMMARY_PROMPT)
-            session.add_query("问题：重复总结请求")
-            result = self.bot.reply_text(session)
-            
-            total_tokens, completion_tokens, reply_content = (
-                result['total_tokens'],
-                result['completion_tokens'],
-                result['content']
-            )
-            
-            logger.debug(
-                "[Summary] total_tokens: %d, completion_tokens: %d, reply_content: %s",
-                total_tokens, completion_tokens, reply_content
-            )
-            
-            if completion_tokens == 0:
-                return Reply(ReplyType.ERROR, "地主家的驴都没我累，请让我休息一会儿")
-            return Reply(ReplyType.TEXT, reply_content)
-            
-        except Exception as e:
-            logger.error(f"[Summary] Failed to get rate limit reply: {e}")
-            return Reply(ReplyType.TEXT, "请稍后再试")
+    def _get_in_progress_reply(self) -> Reply:
+        """获取正在处理中的回复"""
+        return Reply(ReplyType.TEXT, self.reply_pools["in_progress"].take())
 
-def _send_info(e_context: EventContext, content: str):
-    reply = Reply(ReplyType.TEXT, content)
-    channel = e_context["channel"]
-    channel.send(reply, e_context["context"])
+    def _get_rate_limit_reply(self) -> Reply:
+        """获取频率限制的回复"""
+        return Reply(ReplyType.TEXT, self.reply_pools["rate_limit"].take())
@@ -0,0 +1,187 @@
+# encoding:utf-8
+"""
+运行指标
+
+各环节的耗时直方图和计数器，记录在进程内，管理员可以通过"$总结 状态"查看摘要，
+也可以按 Prometheus 文本格式写入文件(配合 node_exporter 的 textfile 采集)或通过端口提供。
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common.log import logger
+
+# 耗时直方图的分桶(秒)
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120)
+# 数量直方图的分桶(条数、token数)
+COUNT_BUCKETS = (10, 100, 1000, 10000, 100000)
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """按分桶估算分位数，返回所在分桶的上限"""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (名称, 标签) -> 值
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets=TIME_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """记录代码块的耗时，出现异常时同样记录"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def render_prometheus(self) -> str:
+        """Prometheus 文本格式"""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            histograms = [(key, h.buckets, list(h.counts), h.sum, h.count) for key, h in histograms]
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for (name, labels), buckets, counts, total, count in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip([f"{bound:g}" for bound in buckets] + ["+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """可读的摘要，供管理员查看"""
+        lines = []
+        with self._lock:
+            for (name, labels), h in sorted(self._histograms.items(), key=lambda item: item[0]):
+                if not h.count:
+                    continue
+                unit = "s" if h.buckets is TIME_BUCKETS else ""
+                average = h.sum / h.count
+                average = f"{average:.3g}" if average < 1000 else f"{average:.0f}"
+                lines.append(f"{_short_name(name)}{_format_labels(labels)}：{h.count}次，"
+                             f"平均 {average}{unit}，p50≤{h.quantile(0.5):g}{unit}，"
+                             f"p95≤{h.quantile(0.95):g}{unit}")
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"{_short_name(name)}{_format_labels(labels)}：{value:g}")
+        return "\n".join(lines) if lines else "暂无指标"
+
+    def write_file(self, path: str):
+        """写入文件，先写临时文件再替换，采集方不会读到写了一半的内容"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def _short_name(name: str) -> str:
+    return name[len("summary_"):] if name.startswith("summary_") else name
+
+
+# 插件内共用的指标
+REGISTRY = Registry()
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+
+# 已启动的导出，插件重新加载时不重复启动
+_exporters = {}
+
+
+def start_file_exporter(path: str, interval: float = 60):
+    """定时将指标写入文件"""
+    if ("file", path) in _exporters:
+        return
+    _exporters[("file", path)] = True
+
+    def run():
+        while True:
+            try:
+                REGISTRY.write_file(path)
+            except Exception as e:
+                logger.error(f"[Summary] failed to write metrics to {path}: {e}")
+            time.sleep(interval)
+
+    threading.Thread(target=run, name="summary-metrics-file", daemon=True).start()
+
+
+def start_http_exporter(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """在端口上提供 /metrics"""
+    if ("http", port) in _exporters:
+        return _exporters[("http", port)]
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = REGISTRY.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="summary-metrics-http", daemon=True).start()
+    _exporters[("http", port)] = server
+    return server
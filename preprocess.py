@@ -0,0 +1,110 @@
+# encoding:utf-8
+"""
+聊天记录预处理
+
+在发送给大模型之前压缩聊天记录：去掉重复刷屏和没有内容的消息，合并同一人连续发送的消息，
+时间只保留时分并按日期分组，截断过长的消息。
+"""
+import re
+import time
+
+from plugins.plugin_summary.chunking import estimate_tokens
+
+# 微信表情的文字占位符，例如 [捂脸]、[动画表情]
+_PLACEHOLDER_RE = re.compile(r"\[[^\[\]\s]{1,8}\]")
+# 去重比较时忽略的字符：空白、标点、符号和 emoji
+_NOISE_RE = re.compile(r"[\s\W_]+")
+# 连续三个以上的笑声字符，例如 哈哈哈哈、hhhh；数字和其他文字重复时含义不同(1000 与 10)，不能合并
+_REPEAT_RE = re.compile(r"([哈呵嘿嘻嘎啊哦噢嗯呜h])\1{2,}")
+
+
+def _normalize(content: str) -> str:
+    """去重用的内容：去掉表情占位符、标点和空白，连续的笑声字符只保留一个"""
+    text = _NOISE_RE.sub("", _PLACEHOLDER_RE.sub("", content)).lower()
+    return _REPEAT_RE.sub(r"\1", text)
+
+
+class _Entry:
+    """同一人连续发送的若干条消息"""
+    __slots__ = ("user", "timestamp", "messages")
+
+    def __init__(self, user, timestamp):
+        self.user = user
+        # 最早一条消息的时间
+        self.timestamp = timestamp
+        # [内容, 重复次数]，按从新到旧的顺序追加
+        self.messages = []
+
+
+class ChatPreprocessor:
+    def __init__(self, dedup: bool = True, collapse: bool = True, relative_time: bool = True,
+                 max_length: int = 300, drop_empty: bool = True, collapse_gap: int = 300):
+        """
+        :param dedup: 相同内容(忽略标点、表情和重复字)只保留最新的一条，并标注重复次数
+        :param collapse: 合并同一人在collapse_gap秒内连续发送的消息
+        :param relative_time: 时间只保留时分，日期单独成行
+        :param max_length: 单条消息的最大字数，超过时截断，0表示不截断
+        :param drop_empty: 去掉只有表情、标点的消息
+        """
+        self.dedup = dedup
+        self.collapse = collapse
+        self.relative_time = relative_time
+        self.max_length = max_length
+        self.drop_empty = drop_empty
+        self.collapse_gap = collapse_gap
+        self._entries = []
+        self._seen = {}
+        # 原始格式的token数，以及预处理后的token数(估算)
+        self.raw_tokens = 0
+        self.tokens = 0
+        self.stats = {"duplicate": 0, "empty": 0, "truncated": 0, "collapsed": 0}
+
+    def feed(self, user: str, content: str, timestamp: int):
+        """按从新到旧的顺序逐条输入聊天记录"""
+        content = (content or "").strip()
+        # 按原始格式 user(YYYY-MM-DD HH:MM:SS): content 估算
+        self.raw_tokens += estimate_tokens(f"{user}(2024-01-01 00:00:00): {content}") + 1
+        key = _normalize(content) if self.dedup or self.drop_empty else content
+        if self.drop_empty and not key:
+            self.stats["empty"] += 1
+            return
+        if self.dedup and key in self._seen:
+            self._seen[key][1] += 1
+            self.stats["duplicate"] += 1
+            return
+        if self.max_length and len(content) > self.max_length:
+            content = content[:self.max_length] + "…"
+            self.stats["truncated"] += 1
+
+        message = [content, 1]
+        if self.dedup:
+            self._seen[key] = message
+        last = self._entries[-1] if self._entries else None
+        if self.collapse and last is not None and last.user == user \
+                and last.timestamp - timestamp <= self.collapse_gap:
+            last.messages.append(message)
+            last.timestamp = timestamp
+            self.stats["collapsed"] += 1
+            self.tokens += estimate_tokens(content) + 1
+            return
+        entry = _Entry(user, timestamp)
+        entry.messages.append(message)
+        self._entries.append(entry)
+        self.tokens += estimate_tokens(user) + estimate_tokens(content) + (3 if self.relative_time else 7)
+
+    def lines(self) -> list:
+        """按时间升序输出预处理后的聊天记录"""
+        lines, last_date = [], None
+        for entry in reversed(self._entries):
+            local = time.localtime(entry.timestamp)
+            content = " / ".join(text if count == 1 else f"{text}(×{count})"
+                                 for text, count in reversed(entry.messages))
+            if self.relative_time:
+                date = time.strftime("%Y-%m-%d", local)
+                if date != last_date:
+                    lines.append(f"[{date}]")
+                    last_date = date
+                lines.append(f"{entry.user} {time.strftime('%H:%M', local)}: {content}")
+            else:
+                lines.append(f"{entry.user}({time.strftime('%Y-%m-%d %H:%M:%S', local)}): {content}")
+        return lines
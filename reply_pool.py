@@ -0,0 +1,89 @@
+# encoding:utf-8
+"""
+预先生成的拒绝回复
+
+"正在总结中"、"已经总结过" 这类回复由大模型批量生成后保存，使用时随机取出一条，
+剩余数量不足时在后台补充，不需要每次都请求大模型。
+"""
+import random
+import re
+import threading
+import time
+
+from common.log import logger
+
+_GENERATE_QUERY = "请一次给出{count}条不同的回答，每条一行，不要编号，不要输出其他内容。"
+_NUMBERING_RE = re.compile(r"^\s*(?:\d+[.、:：)）]|[-*•])\s*")
+# 超过该长度的生成结果视为不合格
+_MAX_LENGTH = 40
+# 两次补充之间的最小间隔(秒)，避免大模型只生成少量回复时频繁补充
+_REFILL_INTERVAL = 60
+
+
+class ReplyPool:
+    def __init__(self, kind: str, prompt: str, default: str, generate, db, size: int = 20):
+        """
+        :param kind: 回复类型，用于在数据库中区分不同的回复
+        :param prompt: 生成回复的prompt
+        :param default: 回复用完且尚未补充时使用的回复
+        :param generate: 调用大模型的函数，参数为(会话id, prompt, 问题)，返回生成的文本
+        :param size: 每次生成的回复数量，剩余不足四分之一时补充
+        """
+        self.kind = kind
+        self.prompt = prompt
+        self.default = default
+        self.generate = generate
+        self.db = db
+        self.size = max(int(size), 1)
+        self._replies = []
+        # 已经用过的回复，新回复用完且尚未补充时从中随机选取
+        self._used = []
+        self._lock = threading.Lock()
+        self._refilling = False
+        self._last_refill = 0
+        try:
+            self._replies = db.get_canned_replies(kind)
+        except Exception as e:
+            logger.error(f"[Summary] failed to load {kind} replies: {e}")
+        self._refill_if_low()
+
+    def take(self) -> str:
+        """随机取出一条回复，不会请求大模型"""
+        with self._lock:
+            if self._replies:
+                reply = self._replies.pop(random.randrange(len(self._replies)))
+                self._used.append(reply)
+                del self._used[:-self.size]
+            else:
+                reply = random.choice(self._used) if self._used else self.default
+        self._refill_if_low()
+        return reply
+
+    def _refill_if_low(self):
+        with self._lock:
+            if self._refilling or len(self._replies) > self.size // 4:
+                return
+            if time.time() - self._last_refill < _REFILL_INTERVAL:
+                return
+            self._refilling = True
+            self._last_refill = time.time()
+        threading.Thread(target=self._refill, name=f"summary-reply-{self.kind}", daemon=True).start()
+
+    def _refill(self):
+        try:
+            text = self.generate(f"__summary_reply_{self.kind}__", self.prompt, _GENERATE_QUERY.format(count=self.size))
+            replies = [_NUMBERING_RE.sub("", line).strip() for line in (text or "").splitlines()]
+            replies = [reply for reply in replies if 0 < len(reply) <= _MAX_LENGTH]
+            if not replies:
+                logger.warning(f"[Summary] no usable {self.kind} replies generated")
+                return
+            with self._lock:
+                self._replies.extend(replies)
+                current = list(self._replies)
+            self.db.save_canned_replies(self.kind, current)
+            logger.info(f"[Summary] refilled {len(replies)} {self.kind} replies")
+        except Exception as e:
+            logger.error(f"[Summary] failed to refill {self.kind} replies: {e}")
+        finally:
+            with self._lock:
+                self._refilling = False
@@ -0,0 +1,78 @@
+# encoding:utf-8
+"""
+会话状态缓存
+
+每个会话是否禁用总结、上次总结时间以及是否有总结正在生成，启动时从数据库加载一次，
+之后的检查只查内存，修改时同时写入数据库。
+"""
+import threading
+import time
+
+
+class SessionState:
+    __slots__ = ("disabled", "summary_time", "in_flight")
+
+    def __init__(self):
+        self.disabled = False
+        # 上次总结时间，没有总结过为None
+        self.summary_time = None
+        # 正在生成的总结的开始时间，没有时为None，不保存到数据库
+        self.in_flight = None
+
+
+# 没有任何状态的会话
+_EMPTY = SessionState()
+
+
+class SessionStates:
+    def __init__(self, db):
+        self.db = db
+        self._states = {}
+        self._lock = threading.Lock()
+        disabled, summary_times = db.load_session_states()
+        for session_id in disabled:
+            self._get_or_create(session_id).disabled = True
+        for session_id, summary_time in summary_times.items():
+            self._get_or_create(session_id).summary_time = summary_time
+
+    def _get_or_create(self, session_id) -> SessionState:
+        state = self._states.get(session_id)
+        if state is None:
+            state = self._states[session_id] = SessionState()
+        return state
+
+    def get(self, session_id) -> SessionState:
+        """会话的当前状态，只读"""
+        return self._states.get(session_id, _EMPTY)
+
+    def is_disabled(self, session_id) -> bool:
+        return self.get(session_id).disabled
+
+    def set_disabled(self, session_id, disabled: bool):
+        if disabled:
+            self.db.save_summary_stop(session_id)
+        else:
+            self.db.delete_summary_stop(session_id)
+        with self._lock:
+            self._get_or_create(session_id).disabled = disabled
+
+    def set_summary_time(self, session_id, summary_time: int):
+        self.db.save_summary_time(session_id, summary_time)
+        with self._lock:
+            self._get_or_create(session_id).summary_time = summary_time
+
+    def begin(self, session_id) -> bool:
+        """标记会话开始生成总结，已有总结正在生成时返回False"""
+        with self._lock:
+            state = self._get_or_create(session_id)
+            if state.in_flight is not None:
+                return False
+            state.in_flight = time.time()
+            return True
+
+    def finish(self, session_id):
+        """标记会话的总结已生成完毕"""
+        with self._lock:
+            state = self._states.get(session_id)
+            if state is not None:
+                state.in_flight = None
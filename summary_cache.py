@@ -0,0 +1,99 @@
+# encoding:utf-8
+"""
+总结结果缓存
+
+同一会话、同一范围且没有新消息时直接返回上次的总结文本和图片，不再请求大模型和生成图片。
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from common.log import logger
+
+# 总结起始时间按该粒度(秒)取整，相近时间发起的相同请求可以命中同一个缓存
+START_BUCKET = 600
+
+
+def make_key(session_id, start_time, limit, usernames, last_record, keyword=None) -> str:
+    """
+    :param last_record: 会话最新一条聊天记录的(时间, 消息id)，有新消息时缓存自然失效
+    """
+    bucket = (start_time or 0) // START_BUCKET
+    users = ",".join(sorted(usernames or []))
+    last_timestamp, last_msgid = last_record or (0, 0)
+    return f"{session_id}|{bucket}|{limit or 0}|{users}|{last_timestamp}|{last_msgid}|{keyword or ''}"
+
+
+class SummaryCache:
+    def __init__(self, ttl: int = 3600, max_bytes: int = 32 * 1024 * 1024, db=None):
+        """
+        :param ttl: 缓存有效期(秒)
+        :param max_bytes: 内存中缓存的总大小上限，超过时淘汰最久未使用的缓存
+        :param db: 不为空时缓存同时保存到数据库，重启后仍然有效
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.db = db
+        self._data = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _entry_size(entry):
+        _, content, image = entry
+        return len(content.encode("utf-8")) + (len(image) if image else 0)
+
+    def get(self, key):
+        """返回(总结文本, 图片内容)，图片内容可能为None；未命中返回None"""
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and now > entry[0]:
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._data.move_to_end(key)
+        if entry is None and self.db is not None:
+            try:
+                entry = self.db.get_cached_summary(key, int(now))
+            except Exception as e:
+                logger.error(f"[Summary] failed to read summary cache: {e}")
+            if entry is not None:
+                self._store(key, entry)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1], entry[2]
+
+    def put(self, key, session_id, content, image=None, ttl: int = None):
+        """
+        :param ttl: 这条缓存的有效期(秒)，默认使用构造时的ttl
+        """
+        now = int(time.time())
+        # 缓存条目为(过期时间, 总结文本, 图片内容)
+        entry = (now + (self.ttl if ttl is None else ttl), content, image)
+        self._store(key, entry)
+        if self.db is not None:
+            try:
+                self.db.save_cached_summary(key, session_id, entry, now)
+            except Exception as e:
+                logger.error(f"[Summary] failed to save summary cache: {e}")
+
+    def _store(self, key, entry):
+        size = self._entry_size(entry)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = entry
+            self._size += size
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._data)))
+
+    def _remove(self, key):
+        entry = self._data.pop(key)
+        self._size -= self._entry_size(entry)
@@ -0,0 +1,49 @@
+# encoding:utf-8
+import pytest
+
+from plugins.plugin_summary import command_parser
+
+
+@pytest.mark.parametrize("text, expected", [
+    # 帮助和 README 中的写法
+    ("999", (999, None)),
+    ("100", (100, None)),
+    ("3小时内消息", (None, 3 * 3600)),
+    ("3 小时内消息", (None, 3 * 3600)),
+    ("前99条", (99, None)),
+    ("前99条信息", (99, None)),
+    ("三十分钟", (None, 30 * 60)),
+    ("3小时内的最近10条消息", (10, 3 * 3600)),
+    ("3小时内的前99条消息", (99, 3 * 3600)),
+    ("", (None, None)),
+    # 中文数字
+    ("九十九条", (99, None)),
+    ("两万三千条", (23000, None)),
+    ("一个半小时", (None, 5400)),
+    ("1.5小时", (None, 5400)),
+    ("帮我总结一下最近两天的聊天记录", (None, 2 * 86400)),
+    # 阿拉伯数字与中文单位混用
+    ("3千条", (3000, None)),
+    ("5百条", (500, None)),
+    ("1万条", (10000, None)),
+    ("1.5万条", (15000, None)),
+    ("3千5百条", (3500, None)),
+    ("2十分钟", (None, 20 * 60)),
+    # 无法确定含义，交给大模型
+    ("前10条和前20条", None),
+    ("昨天下午", None),
+])
+def test_parse(text, expected):
+    assert command_parser.parse(text) == expected
+
+
+def test_parse_today():
+    limit, duration = command_parser.parse("今天")
+    assert limit is None
+    assert 0 <= duration <= 86400
+
+
+def test_extract_keyword():
+    assert command_parser.extract_keyword("关键词:世界杯 今天") == (" 今天", "世界杯")
+    assert command_parser.extract_keyword("关键字：世界杯") == ("", "世界杯")
+    assert command_parser.extract_keyword("3小时") == ("3小时", None)
@@ -0,0 +1,89 @@
+# encoding:utf-8
+import sqlite3
+import time
+
+import pytest
+
+from plugins.plugin_summary import db as db_module
+from plugins.plugin_summary.db import Db
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Db(db_path=str(tmp_path / "chat.db"), archive_dir=str(tmp_path / "archive"))
+    yield db
+    db.close()
+
+
+def _insert(db, session_id, records):
+    """records 为(消息id, 用户名, 时间)"""
+    for msg_id, user, timestamp in records:
+        db.insert_record(session_id, msg_id, user, f"{user}的第{msg_id}条消息", "TEXT", timestamp, 0)
+    db.flush()
+
+
+def test_purge_drops_digest_covering_deleted_records(db):
+    now = int(time.time())
+    _insert(db, "g1", [(1, "甲", now - 3 * 86400), (2, "乙", now - 3 * 86400 + 60)])
+    _insert(db, "g2", [(1, "甲", now - 3600), (2, "乙", now - 60)])
+    db.save_digest("g1", "三天前的总结", now - 3 * 86400, now - 3 * 86400 + 60, 2)
+    db.save_digest("g2", "最近的总结", now - 3600, now - 60, 2)
+
+    db.purge_records(now - 86400)
+
+    assert db.get_digest("g1") is None
+    assert db.get_digest("g2") == ("最近的总结", now - 3600, now - 60, 2)
+
+
+def test_archived_records_match_usernames_like_database(db):
+    now = int(time.time())
+    records = [(index + 1, user, now - 2 * 86400 + index * 60) for index, user in enumerate(["张", "张三", "李四"] * 2)]
+    _insert(db, "g1", records)
+    _insert(db, "g1", [(10 + index, user, now - 60 + index) for index, user in enumerate(["张", "张三"])])
+    assert db.archive_records(now - 86400) == len(records)
+
+    assert {user for _, user, _, _ in db.iter_records("g1", username=["张"])} == {"张"}
+    assert {user for _, user, _, _ in db.iter_records("g1", username=["张三"])} == {"张三"}
+    # 没有完全匹配的用户时按前缀匹配
+    assert {user for _, user, _, _ in db.iter_records("g1", username=["李"])} == {"李四"}
+    assert db.get_speaker_stats("g1", 0, now, username=["张"]) == (1, [("张", 3)])
+
+
+def _legacy_db(path, version, auto_vacuum):
+    """按旧版本的表结构建库，写入一条记录"""
+    conn = sqlite3.connect(path)
+    if auto_vacuum:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    c = conn.cursor()
+    for migration in db_module._MIGRATIONS[:version]:
+        migration(c)
+    if version:
+        c.execute("INSERT INTO users (sessionid, name) VALUES ('g1', '甲')")
+        c.execute("INSERT INTO chat_records (sessionid, msgid, user_id, content, type, timestamp) "
+                  "VALUES ('g1', 1, 1, '明天一起去看世界杯', 'TEXT', ?)", (int(time.time()),))
+    else:
+        c.execute("CREATE TABLE chat_records (sessionid TEXT, msgid INTEGER, user TEXT, content TEXT, type TEXT, "
+                  "timestamp TEXT, is_triggered INTEGER, create_time TEXT, PRIMARY KEY (sessionid, msgid))")
+        c.execute("INSERT INTO chat_records VALUES ('g1', 1, '甲', '明天一起去看世界杯', 'TEXT', ?, 0, NULL)",
+                  (str(int(time.time())),))
+    c.execute("PRAGMA user_version = %d" % version)
+    conn.commit()
+    conn.close()
+
+
+@pytest.mark.parametrize("version, auto_vacuum", [(0, False), (6, False), (6, True)])
+def test_upgrade_builds_full_text_index_once(tmp_path, monkeypatch, version, auto_vacuum):
+    path = str(tmp_path / "chat.db")
+    _legacy_db(path, version, auto_vacuum)
+    rebuilds = []
+    rebuild_fts = Db._rebuild_fts
+    monkeypatch.setattr(Db, "_rebuild_fts", lambda self: rebuilds.append(1) or rebuild_fts(self))
+
+    db = Db(db_path=path, archive_dir=str(tmp_path / "archive"))
+    try:
+        assert len(rebuilds) == 1
+        assert db.conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        if db.fts_enabled:
+            assert [row[2] for row in db.iter_records("g1", keyword="世界杯", context=0)] == ["明天一起去看世界杯"]
+    finally:
+        db.close()
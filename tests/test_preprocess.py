@@ -0,0 +1,33 @@
+# encoding:utf-8
+from plugins.plugin_summary.preprocess import ChatPreprocessor
+
+
+def _feed(messages):
+    """messages 按时间升序给出(用户, 内容)，每条间隔10分钟，避免被合并"""
+    preprocessor = ChatPreprocessor(collapse=False)
+    base = 1700000000
+    for index, (user, content) in reversed(list(enumerate(messages))):
+        preprocessor.feed(user, content, base + index * 600)
+    return preprocessor
+
+
+def test_numbers_are_not_deduplicated():
+    preprocessor = _feed([("甲", "预算1000元"), ("乙", "预算10元"), ("丙", "会议改到11点"), ("丁", "会议改到1点")])
+    text = "\n".join(preprocessor.lines())
+    assert preprocessor.stats["duplicate"] == 0
+    for expected in ("甲 ", "预算1000元", "乙 ", "预算10元", "会议改到11点", "会议改到1点"):
+        assert expected in text
+    assert "×" not in text
+
+
+def test_letters_are_not_deduplicated():
+    preprocessor = _feed([("甲", "good"), ("乙", "god")])
+    assert preprocessor.stats["duplicate"] == 0
+    assert len([line for line in preprocessor.lines() if not line.startswith("[")]) == 2
+
+
+def test_laughter_and_punctuation_are_deduplicated():
+    preprocessor = _feed([("甲", "哈哈哈哈"), ("乙", "哈哈哈哈哈哈！"), ("丙", "收到"), ("丁", "收到！！")])
+    assert preprocessor.stats["duplicate"] == 2
+    text = "\n".join(preprocessor.lines())
+    assert "(×2)" in text
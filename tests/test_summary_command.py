@@ -0,0 +1,92 @@
+# encoding:utf-8
+import functools
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from bridge.context import Context, ContextType
+from plugins import Event, EventContext
+from plugins.plugin_summary import main
+from plugins.plugin_summary.db import Db
+
+
+class _Channel:
+    def __init__(self):
+        self.replies = []
+        self._sent = threading.Event()
+
+    def send(self, reply, context):
+        self.replies.append(reply)
+        self._sent.set()
+
+    def wait(self, timeout=10):
+        assert self._sent.wait(timeout), "summary job did not send a reply"
+        self._sent.clear()
+        return self.replies[-1]
+
+
+@pytest.fixture
+def plugin(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "Db", functools.partial(Db, db_path=str(tmp_path / "chat.db")))
+    calls = []
+
+    def ask_bot(self, session_id, system_prompt, query, priority=None):
+        calls.append(query)
+        return f"总结{len(calls)}", 10, 5
+
+    monkeypatch.setattr(main.Summary, "_ask_bot", ask_bot)
+    monkeypatch.setattr(main.Summary, "convert_text_to_image", lambda self, text: None)
+    summary = main.Summary()
+    summary.llm_calls = calls
+    summary.channel = _Channel()
+    yield summary
+    summary.db.close()
+
+
+def _event(plugin, event, msg_id, user, content, create_time=None):
+    msg = SimpleNamespace(from_user_nickname="g1", from_user_id="@@g1", actual_user_nickname=user,
+                          actual_user_id=user, other_user_nickname="g1", is_at=False, msg_id=msg_id,
+                          create_time=create_time or int(time.time()))
+    context = Context(ContextType.TEXT, content, {"isgroup": True, "msg": msg})
+    return EventContext(event, {"context": context, "channel": plugin.channel})
+
+
+def _chat(plugin, count):
+    now = int(time.time())
+    for index in range(count):
+        plugin.on_receive_message(_event(plugin, Event.ON_RECEIVE_MESSAGE, index + 1, f"用户{index % 3}",
+                                         f"讨论第{index}个话题", now - (count - index) * 60))
+
+
+def _command(plugin, content):
+    """与通道一样，先经过 on_receive_message 再经过 on_handle_context"""
+    plugin.on_receive_message(_event(plugin, Event.ON_RECEIVE_MESSAGE, 10000, "用户0", content))
+    e_context = _event(plugin, Event.ON_HANDLE_CONTEXT, 10000, "用户0", content)
+    plugin.on_handle_context(e_context)
+    return e_context["reply"]
+
+
+def test_command_is_not_saved_and_repeated_summary_hits_cache(plugin):
+    _chat(plugin, 30)
+    assert _command(plugin, "$总结 100").content == "正在加速生成总结，请稍等"
+    first = plugin.channel.wait().content
+    assert "共 30 条消息" in first
+    calls = len(plugin.llm_calls)
+
+    assert _command(plugin, "$总结 100").content == first
+    assert len(plugin.llm_calls) == calls
+    assert plugin.summary_cache.hits == 1
+
+
+def test_plain_summary_after_precompute_uses_prepared_report(plugin):
+    plugin.config.update(precompute=True, precompute_duration=1440)
+    _chat(plugin, 30)
+    plugin._precompute_summary("g1")
+    calls = len(plugin.llm_calls)
+    assert calls > 0
+
+    reply = _command(plugin, "$总结")
+    assert reply.content.startswith("总结")
+    assert len(plugin.llm_calls) == calls
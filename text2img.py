@@ -8,14 +8,16 @@ Description:
 
 Copyright (c) 2024 by sineom, All Rights Reserved. 
 '''
-import os
+import atexit
+import queue
+import socket
+import threading
+from contextlib import contextmanager
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.keys import Keys
 from selenium.common.exceptions import TimeoutException, WebDriverException
-import time
 import base64
 import logging
 
@@ -24,11 +26,27 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 
+def _free_port():
+    """获取一个空闲端口，避免多个浏览器实例的调试端口冲突"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _image_src(driver):
+    """当前生成图片的src，图片还不存在时返回None"""
+    images = driver.find_elements(By.CSS_SELECTOR, 'img[alt="Image"]')
+    return images[0].get_attribute('src') if images else None
+
+
 class Text2ImageConverter:
     def __init__(self):
         self.driver = None
         self.url = 'https://www.text2image.online/zh-cn/'
-        self.output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images')
+        # 已渲染次数，连接池据此回收浏览器
+        self.renders = 0
+        self._page_ready = False
+        self._last_text = None
         
     def setup_driver(self):
         """初始化浏览器驱动"""
@@ -38,7 +56,7 @@ class Text2ImageConverter:
             option.add_argument('--disable-gpu')
             option.add_argument('--no-sandbox')
             option.add_argument('--disable-dev-shm-usage')
-            option.add_argument('--remote-debugging-port=9222')
+            option.add_argument(f'--remote-debugging-port={_free_port()}')
             
             self.driver = webdriver.Chrome(options=option)
             
@@ -46,99 +64,83 @@ class Text2ImageConverter:
             logger.error(f"Failed to initialize Chrome driver: {e}")
             raise
 
-    def convert_text_to_image(self, text):
-        """将文本转换为图片"""
+    def is_alive(self):
+        """健康检查：浏览器仍可响应且页面已加载"""
+        if not self.driver:
+            return False
         try:
-            # 打开网页
-            self.driver.get(self.url)
-            
-            # 等待页面完全加载
-            WebDriverWait(self.driver, 10).until(
-                lambda driver: driver.execute_script("return document.readyState") == "complete"
+            return self.driver.execute_script("return document.readyState") == "complete"
+        except Exception:
+            return False
+
+    def prepare(self):
+        """打开网页并完成一次性的页面设置，之后的渲染只需替换文本"""
+        # 打开网页
+        self.driver.get(self.url)
+
+        # 等待页面完全加载，并等待文本框可交互，确保 JavaScript 已执行
+        WebDriverWait(self.driver, 10).until(
+            lambda driver: driver.execute_script("return document.readyState") == "complete"
+        )
+        WebDriverWait(self.driver, 10).until(
+            EC.element_to_be_clickable((By.CSS_SELECTOR, 'textarea'))
+        )
+        logger.info("Website loaded successfully")
+
+        # 先处理底部链接下拉菜单
+        try:
+            select_element = WebDriverWait(self.driver, 10).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, "div.cell:nth-child(12) select"))
             )
-            time.sleep(1)  # 额外等待以确保 JavaScript 完全执行
-            
-            logger.info("Website loaded successfully")
+            # 使用 JavaScript 来设置选择值，避免直接点击可能引起的问题
+            self.driver.execute_script("""
+                let select = arguments[0];
+                select.value = 'N';  // 假设 '1' 是"隐藏"选项的值
+                select.dispatchEvent(new Event('change'));
+            """, select_element)
+            logger.info("Bottom link hidden")
+        except TimeoutException:
+            logger.warning("Bottom link dropdown menu not found")
+        self._page_ready = True
+        self._last_text = None
 
-            # 先处理底部链接下拉菜单
-            try:
-                select_element = WebDriverWait(self.driver, 10).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, "div.cell:nth-child(12) select"))
-                )
-                # 使用 JavaScript 来设置选择值，避免直接点击可能引起的问题
-                self.driver.execute_script("""
-                    let select = arguments[0];
-                    select.value = 'N';  // 假设 '1' 是"隐藏"选项的值
-                    select.dispatchEvent(new Event('change'));
-                """, select_element)
-                logger.info("Bottom link hidden")
-            except TimeoutException:
-                logger.warning("Bottom link dropdown menu not found")
+    def convert_text_to_image(self, text) -> bytes:
+        """将文本转换为图片，返回PNG图片内容"""
+        try:
+            if not self._page_ready:
+                self.prepare()
 
             # 等待文本框加载并确保它是可交互的
             text_box = WebDriverWait(self.driver, 10).until(
                 EC.element_to_be_clickable((By.CSS_SELECTOR, 'textarea'))
             )
-            logger.info("Text box found and clickable")
 
-            # 使用更可靠的方式清空文本框
-            try:
-                # 先尝试使用 JavaScript 清空
+            if text == self._last_text:
+                # 文本未变化，图片不会重新生成，直接使用当前图片
+                src = _image_src(self.driver)
+            else:
+                old_src = _image_src(self.driver)
+                # 使用 JavaScript 设置文本并触发必要的事件，会直接覆盖原有内容
                 self.driver.execute_script("""
                     let textarea = arguments[0];
-                    textarea.value = '';
+                    textarea.value = arguments[1];
                     textarea.dispatchEvent(new Event('input'));
                     textarea.dispatchEvent(new Event('change'));
-                """, text_box)
-                
-                # 再次检查并确保文本框为空
-                if text_box.get_attribute('value').strip():
-                    # 如果还有内容，使用键盘快捷键清空
-                    text_box.click()
-                    time.sleep(0.5)
-                    text_box.send_keys(Keys.CONTROL + "a")
-                    text_box.send_keys(Keys.DELETE)
-                    time.sleep(0.5)
-                
-                logger.info("Textarea cleared successfully")
-            except Exception as e:
-                logger.warning(f"Error clearing textarea: {e}")
-                # 如果清空失败，我们仍然继续执行，因为接下来的输入可能会覆盖现有内容
+                """, text_box, text)
+                logger.info("Text input completed")
 
-            # 输入新文本
-            # 使用 JavaScript 设置文本，这样更可靠
-            self.driver.execute_script("arguments[0].value = arguments[1];", text_box, text)
-            # 触发必要的事件
-            self.driver.execute_script("""
-                let textarea = arguments[0];
-                textarea.dispatchEvent(new Event('input'));
-                textarea.dispatchEvent(new Event('change'));
-            """, text_box)
-            logger.info("Text input completed")
-
-            # 等待图片生成
-            img_element = WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, 'img[alt="Image"]'))
-            )
-            # 确保图片已经更新（等待src属性变化）
-            time.sleep(0.7)
+                # 等待图片生成：src 变为新的 data url
+                src = WebDriverWait(self.driver, 10).until(
+                    lambda driver: (new_src := _image_src(driver)) and new_src != old_src
+                                   and new_src.startswith('data:') and new_src
+                )
+                self._last_text = text
             logger.info("Image generated")
+            self.renders += 1
 
-            # 获取并保存图片
-            img_base64_data = img_element.get_attribute('src').split(',')[1]
-            img_data = base64.b64decode(img_base64_data)
-            
-            # 确保输出目录存在
-            os.makedirs(self.output_dir, exist_ok=True)
-            
-            # 生成唯一的文件名
-            timestamp = time.strftime("%Y%m%d_%H%M%S")
-            image_path = os.path.join(self.output_dir, f'image_{timestamp}.png')
-            
-            with open(image_path, 'wb') as f:
-                f.write(img_data)
-            logger.info(f"Image saved to {image_path}")
-            return image_path
+            # 图片内容直接在内存中返回，不写入文件
+            img_base64_data = src.split(',')[1]
+            return base64.b64decode(img_base64_data)
 
         except Exception as e:
             logger.error(f"Error during conversion: {e}")
@@ -152,6 +154,101 @@ class Text2ImageConverter:
                 logger.info("Browser closed successfully")
             except Exception as e:
                 logger.error(f"Error closing browser: {e}")
+            self.driver = None
+
+
+class Text2ImagePool:
+    """常驻的浏览器连接池，浏览器启动后预先加载好页面，渲染时直接复用"""
+
+    def __init__(self, size=1, max_renders=50, acquire_timeout=60):
+        """
+        :param size: 最多同时存在的浏览器数量
+        :param max_renders: 单个浏览器渲染多少次后回收重建，防止内存膨胀
+        :param acquire_timeout: 等待空闲浏览器的最长时间(秒)
+        """
+        self.size = max(int(size), 1)
+        self.max_renders = max(int(max_renders), 1)
+        self.acquire_timeout = acquire_timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def warm_up(self):
+        """在后台线程中预先启动浏览器并加载页面"""
+        def _warm():
+            converters = []
+            try:
+                for _ in range(self.size):
+                    converter = self._create()
+                    if converter is None:
+                        break
+                    converters.append(converter)
+            except Exception as e:
+                logger.error(f"Failed to warm up browser pool: {e}")
+            for converter in converters:
+                self._idle.put(converter)
+        threading.Thread(target=_warm, name="text2img-warm-up", daemon=True).start()
+
+    def _create(self):
+        """新建一个浏览器，已达上限时返回None"""
+        with self._lock:
+            if self._created >= self.size:
+                return None
+            self._created += 1
+        converter = Text2ImageConverter()
+        try:
+            converter.setup_driver()
+            converter.prepare()
+        except Exception:
+            self._discard(converter)
+            raise
+        return converter
+
+    def _discard(self, converter):
+        converter.close()
+        with self._lock:
+            self._created -= 1
+
+    @contextmanager
+    def acquire(self):
+        """借出一个可用的浏览器，渲染失败或达到渲染次数上限时回收"""
+        converter = None
+        while converter is None:
+            try:
+                converter = self._idle.get_nowait()
+            except queue.Empty:
+                converter = self._create()
+                if converter is None:
+                    converter = self._idle.get(timeout=self.acquire_timeout)
+            if not converter.is_alive():
+                logger.warning("Browser is not healthy, recreating")
+                self._discard(converter)
+                converter = None
+
+        healthy = False
+        try:
+            yield converter
+            healthy = True
+        finally:
+            if healthy and converter.renders < self.max_renders:
+                self._idle.put(converter)
+            else:
+                self._discard(converter)
+
+    def convert_text_to_image(self, text) -> bytes:
+        """将文本转换为图片，返回PNG图片内容"""
+        with self.acquire() as converter:
+            return converter.convert_text_to_image(text)
+
+    def close(self):
+        """关闭所有空闲的浏览器"""
+        while True:
+            try:
+                converter = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(converter)
 
 def main():
     converter = Text2ImageConverter()
@@ -166,8 +263,8 @@ def main():
         - 提及"额外腐恶费"和"发热"
         - 请求妮可进行总结"""
         
-        image_path = converter.convert_text_to_image(text)
-        print(f"Image generated successfully at: {image_path}")
+        image = converter.convert_text_to_image(text)
+        print(f"Image generated successfully: {len(image)} bytes")
         
     except Exception as e:
         logger.error(f"Process failed: {e}")